@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+# runs htb.py commands against bench/mock_server.py and reports how long they took,
+# how many requests they sent and how many bytes came back
+# every command runs in a fresh process like it would from a shell, with the daemon disabled
+#
+#     ./bench/benchmark.py                       # default 20ms latency, 300 retired machines
+#     ./bench/benchmark.py --latency 100 --retired 3000 --runs 5
+#     ./bench/benchmark.py --save baseline.json
+#     ./bench/benchmark.py --compare baseline.json   # exits 1 if a command sends more requests or bytes than before
+#
+# 'cold' runs start with an empty cache directory, 'warm' runs reuse the one from the cold run
+# the startup rows come from python -X importtime: how long htb.py's own imports take and how many modules it loads
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+import urllib.request
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mock_server import MockHTB, serve
+
+HTB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'htb.py')
+
+# (name, args, stdin)
+# the mock server's to-do list is emptied before every run so -T always adds
+COMMANDS = [
+        ('active', ['-a'], None),
+        ('machine', ['-m', 'lame'], None),
+        ('machine-active', ['-m'], None),
+        ('machine-batch', ['-m', '-'], 'lame Box2 Box3 Box4 Box5 Box6 Box7 Box8\n'),
+        ('starting-point', ['-m', 'meow'], None),
+        ('todo', ['-t'], None),
+        ('todo-update', ['-T', 'lame'], None),
+        ('todo-batch', ['-T', '-'], 'lame Box2 Box3 Box4 Box5 Box6 Box7 Box8\n'),
+        ('spawn', ['-S', 'lame'], None),
+        ('reset', ['-R'], None),
+        ('kill', ['-K'], None),
+        ('flag', ['-F', '0123456789abcdef0123456789abcdef'], '5\n'),
+        ('writeup', ['-w', 'lame'], None),
+        ('accounts', ['-a', '--accounts'], None),
+        ]
+
+# the accounts file --accounts runs with, written to each run's work dir
+ACCOUNTS = ['alice', 'bob', 'carol', 'dave']
+
+# (name, python args) for the startup rows, none of them send requests
+STARTUP = [
+        ('startup -h', [HTB, '-h']),
+        ('startup import', ['-c', 'import htb']),
+        ]
+
+# runs python -X importtime with args, returns {module: cumulative microseconds} for the top level imports
+# and the set of every module imported
+def importtime(args):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(HTB))
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, env=env, capture_output=True, text=True)
+    top_level = {}
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        modules.add(name.strip())
+        if not name.startswith('  '):
+            top_level[name.strip()] = int(cumulative)
+    return top_level, modules
+
+# times the startup of htb.py `runs` times, not counting what python imports before running anything (site etc.)
+# returns {name: {'cold': {...}}} like benchmark() with the median time and the number of modules imported
+def startup(runs):
+    _, interpreter_modules = importtime(['-c', 'pass'])
+    results = {}
+    for name, args in STARTUP:
+        times = []
+        for _ in range(runs):
+            top_level, modules = importtime(args)
+            times.append(sum(microseconds for module, microseconds in top_level.items() if module not in interpreter_modules))
+        results[name] = {'cold': {'ms': round(statistics.median(times) / 1000, 1), 'requests': 0, 'bytes': 0,
+                                  'modules': len(modules - interpreter_modules)}}
+    return results
+
+# asks the mock server for its counters, or resets them
+def mock_stats(url, reset=False):
+    if reset:
+        request = urllib.request.Request(url + '/__reset', data=b'', method='POST')
+    else:
+        request = urllib.request.Request(url + '/__stats')
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+# runs one htb.py command, returns (seconds, requests, bytes)
+def run(url, args, stdin, cache_dir, work_dir):
+    env = dict(os.environ)
+    env.update({
+        'API_TOKEN': 'benchmark',
+        'API_URL': url + '/api/v4',
+        'XDG_CACHE_HOME': cache_dir,
+        'XDG_RUNTIME_DIR': cache_dir,
+        'ACCOUNTS_FILE': os.path.join(work_dir, 'accounts.env'),
+        # the benchmark measures round trips, not the rate limiter
+        'RATE_LIMIT': '0'
+        })
+    with open(os.path.join(work_dir, 'accounts.env'), 'w') as f:
+        f.writelines(f'{name}=benchmark-{name}\n' for name in ACCOUNTS)
+    mock_stats(url, reset=True)
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, HTB, '--no-daemon'] + args, input=stdin, text=True, env=env, cwd=work_dir, capture_output=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        print(f'htb.py {" ".join(args)} failed:\n{result.stdout}{result.stderr}', file=sys.stderr)
+    stats = mock_stats(url)
+    return elapsed, stats['requests'], stats['bytes']
+
+# runs every command `runs` times in both cache states
+# returns {name: {'cold': {...}, 'warm': {...}}} with the median time
+def benchmark(url, runs):
+    results = {}
+    for name, args, stdin in COMMANDS:
+        results[name] = {}
+        for state in ('cold', 'warm'):
+            times = []
+            for _ in range(runs):
+                cache_dir = tempfile.mkdtemp(prefix='htb-bench-cache-')
+                work_dir = tempfile.mkdtemp(prefix='htb-bench-work-')
+                try:
+                    if state == 'warm':
+                        # fill the cache (and download the writeup) first
+                        run(url, args, stdin, cache_dir, work_dir)
+                    elapsed, requests, size = run(url, args, stdin, cache_dir, work_dir)
+                finally:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                times.append(elapsed)
+            results[name][state] = {'ms': round(statistics.median(times) * 1000, 1), 'requests': requests, 'bytes': size}
+    return results
+
+def print_results(results):
+    print(f'{"command":<16} {"cache":<5} {"ms":>9} {"requests":>9} {"bytes":>11} {"modules":>8}')
+    for name, states in results.items():
+        for state, result in states.items():
+            print(f'{name:<16} {state:<5} {result["ms"]:>9} {result["requests"]:>9} {result["bytes"]:>11} {result.get("modules", ""):>8}')
+
+# compares results with a saved baseline, returns a list of regressions
+# more requests, bytes or imported modules is a regression, times are too noisy to fail on so they only get flagged past 50% slower
+def compare(results, baseline):
+    regressions = []
+    for name, states in results.items():
+        for state, result in states.items():
+            old = baseline.get(name, {}).get(state)
+            if not old:
+                continue
+            if result['requests'] > old['requests']:
+                regressions.append(f'{name} ({state}): {old["requests"]} -> {result["requests"]} requests')
+            if result['bytes'] > old['bytes'] * 1.1:
+                regressions.append(f'{name} ({state}): {old["bytes"]} -> {result["bytes"]} bytes')
+            if 'modules' in old and result['modules'] > old['modules']:
+                regressions.append(f'{name}: {old["modules"]} -> {result["modules"]} modules imported')
+            if result['ms'] > old['ms'] * 1.5:
+                print(f'warning: {name} ({state}) went from {old["ms"]}ms to {result["ms"]}ms', file=sys.stderr)
+    return regressions
+
+def main():
+    parser = ArgumentParser(description='benchmark htb.py against the mock HTB API')
+    parser.add_argument('--latency', type=float, default=20, help='milliseconds the mock server adds to every request')
+    parser.add_argument('--retired', type=int, default=300, help='number of retired machines in the mock lists')
+    parser.add_argument('--writeup-size', type=int, default=2 * 1024 * 1024, help='writeup pdf size in bytes')
+    parser.add_argument('--runs', type=int, default=3, help='runs per command, the median is reported')
+    parser.add_argument('--save', metavar='file', help='save the results as json')
+    parser.add_argument('--compare', metavar='file', help='compare with results saved by --save')
+    args = parser.parse_args()
+
+    mock = MockHTB(latency=args.latency / 1000, retired=args.retired, writeup_size=args.writeup_size)
+    server = serve(mock)
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    results = benchmark(url, args.runs)
+    server.shutdown()
+    results.update(startup(args.runs))
+
+    print_results(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=4)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print('\nregressions:')
+            for regression in regressions:
+                print(f'  {regression}')
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
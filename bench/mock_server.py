@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# stand-in for the HackTheBox API so htb.py can be measured without hitting the real thing
+# replays the responses in bench/fixtures for every endpoint htb.py uses
+# the machine lists get generated from fixtures/machine.json so their size can be turned up
+#
+# run it on its own and point htb.py at it:
+#     ./bench/mock_server.py --latency 50 --retired 3000
+#     API_URL=http://127.0.0.1:8642/api/v4 ./htb.py -a
+# or import it, see bench/benchmark.py
+#
+# GET /__stats returns {'requests', 'bytes'} served so far, POST /__reset zeroes them
+
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# reads a fixture file
+def fixture(name):
+    with open(os.path.join(FIXTURES, name + '.json'), 'r') as f:
+        return json.load(f)
+
+# everything the server answers with, built once by build_data()
+# latency is added to every request in seconds
+# spawn_time is how long /machine/active says the machine is still spawning after a /vm/spawn
+class MockHTB:
+    def __init__(self, latency=0, active=20, retired=300, starting_point=30, writeup_size=2 * 1024 * 1024, spawn_time=0):
+        self.latency = latency
+        self.spawn_time = spawn_time
+        self.spawned_at = 0
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.todo = set()
+        self.active_machine = fixture('active')
+        self.reviews = fixture('reviews')
+        self.responses = fixture('responses')
+        self.writeup = b'%PDF-1.4\n' + b'0' * max(0, writeup_size - 9)
+        self.writeup_etag = '"' + hashlib.md5(self.writeup).hexdigest() + '"'
+        self.build_data(active, retired, starting_point)
+
+    # makes the machine lists out of the fixture machine
+    # machine 1 is always Lame (retired) so the usual examples work
+    def build_data(self, active, retired, starting_point):
+        template = fixture('machine')
+        self.machines = {}
+        for m_id in range(1, active + retired + 1):
+            machine = dict(template)
+            machine['id'] = m_id
+            machine['name'] = template['name'] if m_id == 1 else f'Box{m_id}'
+            machine['ip'] = f'10.10.{m_id // 256}.{m_id % 256}'
+            machine['retired'] = 1 if m_id <= retired else 0
+            self.machines[m_id] = machine
+        self.by_name = {machine['name'].lower(): machine for machine in self.machines.values()}
+        self.active_list = [machine for machine in self.machines.values() if not machine['retired']]
+        self.retired_list = [machine for machine in self.machines.values() if machine['retired']]
+
+        sp_template = fixture('sp_machine')
+        self.sp_machines = []
+        for index in range(starting_point):
+            machine = dict(sp_template)
+            machine['id'] = sp_template['id'] + index
+            machine['name'] = sp_template['name'] if index == 0 else f'Sp{machine["id"]}'
+            self.sp_machines.append(machine)
+
+    # finds a lab machine by name or id
+    def find(self, name_or_id):
+        if name_or_id.isnumeric():
+            return self.machines.get(int(name_or_id))
+        return self.by_name.get(name_or_id.lower())
+
+    def is_starting_point(self, name_or_id):
+        return any(name_or_id.lower() == machine['name'].lower() or name_or_id == str(machine['id']) for machine in self.sp_machines)
+
+    # returns (status, body) for a GET, body is a dict or bytes
+    def handle_get(self, path):
+        if path == '/machine/active':
+            spawning = time.time() - self.spawned_at < self.spawn_time
+            return 200, {'info': dict(self.active_machine['info'], isSpawning=spawning)}
+        if path == '/machine/list':
+            return 200, {'info': self.active_list}
+        if path == '/machine/list/retired':
+            return 200, {'info': self.retired_list}
+        if path == '/sp/machines':
+            return 200, {'info': self.sp_machines}
+        if path == '/machine/todo':
+            return 200, {'info': [self.machines[m_id] for m_id in sorted(self.todo)]}
+        if path.startswith('/machine/profile/'):
+            name_or_id = path.rsplit('/', 1)[1]
+            machine = self.find(name_or_id)
+            if machine:
+                return 200, {'info': machine}
+            if self.is_starting_point(name_or_id):
+                return 404, self.responses['profile_starting_point']
+            return 404, self.responses['profile_not_found']
+        if path.startswith('/machine/reviews/'):
+            machine = self.find(path.rsplit('/', 1)[1])
+            return 200, self.reviews if machine and machine['retired'] else self.responses['no_reviews']
+        if path.startswith('/machine/writeup/'):
+            machine = self.find(path.rsplit('/', 1)[1])
+            if machine and machine['retired']:
+                return 200, self.writeup
+            return 404, self.responses['writeup_missing']
+        return 404, {'message': 'not found'}
+
+    # returns (status, body) for a POST
+    def handle_post(self, path):
+        if path == '/vm/spawn':
+            self.spawned_at = time.time()
+            return 200, self.responses['spawn']
+        if path == '/vm/terminate':
+            return 200, self.responses['terminate']
+        if path == '/vm/reset':
+            return 200, self.responses['reset']
+        if path == '/machine/own':
+            return 200, self.responses['own']
+        if path.startswith('/machine/todo/update/'):
+            machine = self.find(path.rsplit('/', 1)[1])
+            if not machine:
+                return 404, self.responses['profile_not_found']
+            with self.lock:
+                self.todo ^= {machine['id']}
+            return self.handle_get('/machine/todo')
+        return 404, {'message': 'not found'}
+
+    # counts a served request
+    def record(self, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+
+# serves a MockHTB, the API lives under /api/v4 like the real one
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path == '/__stats':
+            return self.reply(200, {'requests': self.mock.requests, 'bytes': self.mock.bytes}, count=False)
+        status, body = self.mock.handle_get(self.api_path())
+        if isinstance(body, bytes):
+            return self.reply_writeup(body)
+        self.reply(status, body, etag=True)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path == '/__reset':
+            with self.mock.lock:
+                self.mock.requests = 0
+                self.mock.bytes = 0
+                self.mock.todo = set()
+            return self.reply(200, {}, count=False)
+        self.reply(*self.mock.handle_post(self.api_path()))
+
+    def api_path(self):
+        time.sleep(self.mock.latency)
+        return self.path.split('/api/v4', 1)[-1].split('?')[0]
+
+    # etag=True sends an ETag and answers a matching If-None-Match with a 304
+    def reply(self, status, data, count=True, etag=False):
+        body = json.dumps(data).encode()
+        if etag and status == 200:
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return self.mock.record(0) if count else None
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        if etag and status == 200:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if count:
+            self.mock.record(len(body))
+
+    # writeups support ETag/If-None-Match and Range/If-Range like a normal file server
+    def reply_writeup(self, body):
+        etag = self.mock.writeup_etag
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return self.mock.record(0)
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', etag) == etag:
+            start = int(range_header.split('=', 1)[1].split('-')[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return self.mock.record(0)
+            body = body[start:]
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+        self.mock.record(len(body))
+
+# starts a server for mock on a background thread, returns the server
+# port 0 picks a free port, the real one is server.server_address[1]
+def serve(mock, host='127.0.0.1', port=0):
+    handler = type('BoundHandler', (Handler,), {'mock': mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = ArgumentParser(description='mock HackTheBox API for benchmarking htb.py')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every request')
+    parser.add_argument('--active', type=int, default=20, help='number of active lab machines')
+    parser.add_argument('--retired', type=int, default=300, help='number of retired lab machines')
+    parser.add_argument('--starting-point', type=int, default=30, help='number of starting point machines')
+    parser.add_argument('--writeup-size', type=int, default=2 * 1024 * 1024, help='writeup pdf size in bytes')
+    parser.add_argument('--spawn-time', type=float, default=0, help='seconds a spawned machine stays spawning')
+    args = parser.parse_args()
+    mock = MockHTB(args.latency / 1000, args.active, args.retired, args.starting_point, args.writeup_size, args.spawn_time)
+    server = serve(mock, port=args.port)
+    print(f'mock HTB API on http://127.0.0.1:{server.server_address[1]}/api/v4', file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
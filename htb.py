@@ -5,50 +5,179 @@
 # https://github.com/D3vil0per/HackTheBox-API
 # https://pyhackthebox.readthedocs.io/en/latest/index.html
 # TODO
-# cache active machine IP somewhere so each call to -a doesn't take a year?
 # -X: submit review https://github.com/D3vil0p3r/HackTheBox-API#submit-a-machine-review
 # -u user: user info, if no user is provided assume self
-# some kind of machine display system to show machines sorted in an interactive interface
+# --list covers the sorting part, still no interactive interface though
 # colored output?
 
-import requests
-from argparse import ArgumentParser, RawDescriptionHelpFormatter
-from dotenv import load_dotenv
+# this file is both the script and a small library, importing it doesn't do anything
+# from htb import HTBClient
+# client = HTBClient('your_api_token_here')
+# client.get_active() -> dict about the spawned machine, or None
+# AsyncHTBClient has all the same methods but they're coroutines
+
+# only cheap imports up here so -h, --list and commands sent to the daemon start fast
+# requests/urllib3 (most of the startup time), dotenv, asyncio, sqlite3 and the rest get imported where they're used,
+# and HTBClient only makes its session when it sends its first request, so anything the caches answer never loads requests
+# python -X importtime ./htb.py -h shows what's left, bench/benchmark.py keeps track of it
+from argparse import ArgumentParser, RawDescriptionHelpFormatter, SUPPRESS
 import os
 import sys
 import json
 import time
+import fcntl
+import socket
+import threading
 from datetime import datetime, timedelta
 
+# orjson parses the big machine lists a lot faster, it gets used if it's installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 ENABLE_DEBUGGING = False
-if ENABLE_DEBUGGING:
-    from IPython import embed
-
-# get API token from .env
-load_dotenv()
-TOKEN = os.getenv('API_TOKEN')
-HEADERS = {
-        'Authorization': f'Bearer {TOKEN}',
-        'User-Agent': 'bruh'
-        }
+
 BASEURL = 'https://www.hackthebox.com/api/v4'
 
-# parse command line arguments
-parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, description='simple commands to call the HackTheBox v4 API\nall commands are mutually exclusive')
-group = parser.add_mutually_exclusive_group()
-group.add_argument('-m', type=str, metavar='machine', help='print info about a machine (default: active)', nargs='?', const=True)
-group.add_argument('-a', action='store_true', help='show currently active (spawned) machine')
-group.add_argument('-w', type=str, metavar='machine', help='get official pdf writeup for a machine (default: active) and save it to a file', nargs='?', const=True)
-group.add_argument('-t', action='store_true', help='print current to-do list')
-group.add_argument('-T', type=str, metavar='machine', help='add or remove a machine from your to-do list')
-group.add_argument('-S', type=str, metavar='machine', help='spawn an instance of a machine')
-group.add_argument('-K', action='store_true', help='kill the currently active machine')
-group.add_argument('-R', action='store_true', help='request a reset for the currently active machine')
-group.add_argument('-F', type=str, metavar='flag', help='submit flag for the currently active machine - either flag text or a filename')
-if ENABLE_DEBUGGING:
-    group.add_argument('-d', action='store_true', help='debug mode')
-
-args = parser.parse_args()
+# local cache for the machine lists so get_ip() doesn't have to download every machine every time
+# lives in $XDG_CACHE_HOME/htb-api (usually ~/.cache/htb-api)
+CACHE_DIR = os.path.join(os.getenv('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'htb-api')
+# how long each cached list stays fresh, in seconds
+# the active list changes every week or so, the retired list basically never
+LIST_TTLS = {
+        '/machine/list': 6 * 60 * 60,
+        '/machine/list/retired': 7 * 24 * 60 * 60
+        }
+# the fields in a machine list entry that are about whoever's token downloaded it
+# they get left out of lists shared between accounts (see HTBClient's list_cache_dir)
+PER_USER_FIELDS = ('authUserInUserOwns', 'authUserInRootOwns', 'authUserHasReviewed', 'isCompleted', 'playInfo')
+# -m and -T with at least this many machine names download the lists up front if they aren't cached,
+# fewer names are cheaper as a /machine/profile lookup each (see preload_machine_lists())
+LIST_PRELOAD_BATCH = 10
+
+# GET responses that get kept on disk and revalidated with ETag/Last-Modified, see HTBClient.cached_body()
+# endpoint (or prefix ending in /): (fresh, stale) in seconds
+# fresh responses are used without asking HTB at all, stale ones are used right away
+# while a background request revalidates them, anything older gets revalidated before it's used
+# the machine lists aren't in here, their index files keep the validators themselves (see get_machine_list())
+RESPONSE_CACHE = {
+        '/sp/machines': (60 * 60, 7 * 24 * 60 * 60),
+        '/machine/reviews/': (10 * 60, 24 * 60 * 60)
+        }
+
+# sqlite index of every machine for --list, see HTBClient.sync_machine_db()
+# each source is synced again once it's older than its TTL (the same TTLs as the caches above)
+MACHINE_DB_SOURCES = {
+        '/machine/list': ('active', LIST_TTLS['/machine/list']),
+        '/machine/list/retired': ('retired', LIST_TTLS['/machine/list/retired']),
+        '/sp/machines': ('starting_point', RESPONSE_CACHE['/sp/machines'][0])
+        }
+# what --sort can sort by, as ORDER BY clauses
+MACHINE_SORTS = {
+        'name': 'name COLLATE NOCASE',
+        'stars': 'stars DESC, name COLLATE NOCASE',
+        'release': 'release DESC',
+        'difficulty': 'difficulty_rank, difficulty_rating, name COLLATE NOCASE',
+        'owns': 'user_owns DESC'
+        }
+# difficultyText in order, so sorting by difficulty works for starting point machines too (they don't have a rating)
+DIFFICULTY_TEXTS = ['Very Easy', 'Easy', 'Medium', 'Hard', 'Insane']
+
+# columns for --format table (and --list), (header, value) for a machine dict
+# machines from the API need a 'group' added ('active', 'retired' or 'starting_point'), query_machines() has one
+MACHINE_COLUMNS = [
+        ('name', lambda machine: machine['name']),
+        ('id', lambda machine: machine['id']),
+        ('os', lambda machine: machine.get('os')),
+        ('difficulty', lambda machine: machine.get('difficultyText')),
+        ('stars', lambda machine: f'{float(machine["stars"]):.1f}' if machine.get('stars') is not None else None),
+        ('released', lambda machine: (machine.get('release') or '').split('T')[0]),
+        ('group', lambda machine: (machine.get('group') or '').replace('_', ' ')),
+        ('owned', lambda machine: 'root' if machine.get('authUserInRootOwns') else 'user' if machine.get('authUserInUserOwns') else '')
+        ]
+# the same for -a and -T
+ACTIVE_COLUMNS = [
+        ('name', lambda info: info['name']),
+        ('id', lambda info: info['id']),
+        ('ip', lambda info: info.get('ip')),
+        ('expires', lambda info: info.get('expires_at'))
+        ]
+TODO_COLUMNS = [
+        ('machine', lambda record: record['machine']),
+        ('result', lambda record: record['result'] or 'no such machine')
+        ]
+
+# where the daemon (--daemon) listens, the script sends commands here if it exists
+SOCKET_PATH = os.path.join(os.getenv('XDG_RUNTIME_DIR') or CACHE_DIR, 'htb-api.sock')
+# --accounts: the profile file, one NAME=token line per account like .env (ACCOUNTS_FILE in .env to put it elsewhere)
+# every account gets its own cache dir under accounts/ in CACHE_DIR, so its own active machine, cached responses,
+# rate limit bucket and machines.db, but the machine lists (and completion index) in shared/ are shared by all of them
+# (without PER_USER_FIELDS, so the lists in CACHE_DIR that the script normally uses keep their owner's flags)
+ACCOUNTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'accounts.env')
+# how often the daemon refreshes the active machine and checks the machine lists, in seconds
+DAEMON_REFRESH = 60
+# how long the script reuses the active machine between runs, in seconds (ACTIVE_TTL in .env)
+# spawning, killing or resetting a machine with the script throws it away early
+ACTIVE_TTL = 30
+
+# longest a retry waits, for the exponential backoff and for Retry-After
+# a rate limited request that HTB says to retry any later than this fails instead of hanging the script
+MAX_RETRY_DELAY = 30
+
+# -S --wait: how long to wait for a spawned machine, and the polling backoff (first delay, multiplier, max delay) in seconds
+SPAWN_TIMEOUT = 10 * 60
+SPAWN_POLL = (1, 1.5, 10)
+# ports tried by --probe, a refused connection counts too since it means the machine answered
+PROBE_PORTS = (22, 80, 443, 445, 3389)
+
+# shell completion scripts printed by --completion, @PROG@ and @OPTIONS@ get filled in by completion_script()
+# they call back into the script with --complete for machine names, see complete_machine_names()
+# zsh reuses the bash one through bashcompinit
+COMPLETION_SCRIPTS = {
+        'bash': '''_htb_api() {
+    local cur=${COMP_WORDS[COMP_CWORD]} i
+    if [[ $cur == -* ]]; then
+        COMPREPLY=($(compgen -W "@OPTIONS@" -- "$cur"))
+        return
+    fi
+    # machine names after -m, -w and -T (which take several) and right after -S
+    for ((i = COMP_CWORD - 1; i > 0; i--)); do
+        case ${COMP_WORDS[i]} in
+            -m|-w|-T) break ;;
+            -S) ((i == COMP_CWORD - 1)) && break; return ;;
+            -*) return ;;
+        esac
+    done
+    ((i > 0)) || return
+    COMPREPLY=($("${COMP_WORDS[0]}" --complete="$cur" 2>/dev/null))
+}
+complete -o default -F _htb_api @PROG@
+''',
+        'fish': '''function __htb_api_machine_arg
+    set -l tokens (commandline -opc)
+    for i in (seq (count $tokens) -1 2)
+        switch $tokens[$i]
+            case -m -w -T
+                return 0
+            case -S
+                test $i -eq (count $tokens)
+                return
+            case '-*'
+                return 1
+        end
+    end
+    return 1
+end
+function __htb_api_machines
+    set -l command (commandline -opc)[1]
+    $command --complete=(commandline -ct) 2>/dev/null
+end
+complete -c @PROG@ -n __htb_api_machine_arg -f -a '(__htb_api_machines)'
+@OPTIONS@
+'''
+        }
+COMPLETION_SCRIPTS['zsh'] = 'autoload -U +X bashcompinit && bashcompinit\n' + COMPLETION_SCRIPTS['bash']
 
 # putting difficulty strings in order to interpret responses later
 difficulty = [
@@ -64,100 +193,1477 @@ difficulty = [
         "counterBrainFuck"
         ]
 
-# functions (bc im too lazy to implement a class)
+# request tracing (--trace / --metrics-json)
+# HTBClient.send() puts the span (a dict) for the request it's sending here,
+# and the connection classes below add DNS/connect/TLS timings to it if they open a new connection
+TRACE = threading.local()
+
+# the traced classes subclass requests' and urllib3's, which are slow to import,
+# so they only get defined once the first HTBClient needs them
+TRACED_ADAPTER = None
+
+# returns TracedHTTPAdapter, defining it (and the connection classes it uses) the first time
+def traced_adapter():
+    global TRACED_ADAPTER
+    if TRACED_ADAPTER:
+        return TRACED_ADAPTER
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+
+    # times DNS and the TCP connect separately by resolving the host first and then connecting to each address
+    # in turn (like urllib3 would), TLS still checks the real hostname since host gets put back before the handshake
+    class TracedConnectionMixin:
+        def _new_conn(self):
+            span = getattr(TRACE, 'span', None)
+            if span is None:
+                return super()._new_conn()
+            span['new_connection'] = True
+            dns_host = self._dns_host
+            start = time.perf_counter()
+            try:
+                addresses = [info[4][0] for info in socket.getaddrinfo(dns_host, self.port, 0, socket.SOCK_STREAM)]
+            # let urllib3 fail on its own so it raises the usual errors
+            except OSError:
+                addresses = [dns_host]
+            resolved = time.perf_counter()
+            span['dns_ms'] = round((resolved - start) * 1000, 2)
+            try:
+                for index, address in enumerate(addresses):
+                    self._dns_host = address
+                    try:
+                        return super()._new_conn()
+                    except (NewConnectionError, ConnectTimeoutError):
+                        if index == len(addresses) - 1:
+                            raise
+            finally:
+                self._dns_host = dns_host
+                span['connect_ms'] = round((time.perf_counter() - resolved) * 1000, 2)
+
+    class TracedHTTPConnection(TracedConnectionMixin, HTTPConnection):
+        pass
+
+    # connect() is _new_conn() plus the TLS handshake, so TLS is whatever's left over
+    class TracedHTTPSConnection(TracedConnectionMixin, HTTPSConnection):
+        def connect(self):
+            span = getattr(TRACE, 'span', None)
+            start = time.perf_counter()
+            super().connect()
+            if span is not None:
+                elapsed = (time.perf_counter() - start) * 1000
+                span['tls_ms'] = round(elapsed - span.get('dns_ms', 0) - span.get('connect_ms', 0), 2)
+
+    class TracedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TracedHTTPConnection
+
+    class TracedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TracedHTTPSConnection
+
+    # the adapter HTBClient mounts, same as requests' but with the traced connections
+    class TracedHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {'http': TracedHTTPConnectionPool, 'https': TracedHTTPSConnectionPool}
+
+    TRACED_ADAPTER = TracedHTTPAdapter
+    return TRACED_ADAPTER
+
+# True if a request that failed with the requests exception e never got to HTB
+# (DNS failed, the connection was refused or timed out), so even a POST is safe to send again
+def never_sent(e):
+    import requests
+    from urllib3.exceptions import NewConnectionError
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, which has the actual error as its reason
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(e, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+# raised by HTBClient when a request can't be made at all (no token, timeout, HTB unreachable)
+# the script catches it and prints the message
+class HTBError(Exception):
+    pass
+
+# talks to the API and returns the data instead of printing it
+# holds everything that should live as long as the client does:
+# the pooled session, the machine list indexes and the writeup ETag lock
+# token is the API token, the rest is the same stuff the script reads from .env
+# refresh=True ignores the machine list cache the first time each list is needed
+# active_ttl is how many seconds get_active() can reuse its last answer, even one saved by another process (0 = always ask HTB)
+# rate_limit is requests per second (shared by every process using the same cache dir), rate_burst how many can go at once,
+# retries how many times a rate limited or failed request gets retried
+# list_cache_dir is where the machine lists and the completion index go (default: cache_dir), so clients for different
+# accounts can each have their own cache_dir but share the lists, machine_lists shares the loaded indexes too (see --accounts)
+# shared lists are kept without PER_USER_FIELDS, each account's owned flags only live in its own machines.db
+class HTBClient:
+    def __init__(self, token, pool_size=4, timeout=(5, 30), cache_dir=CACHE_DIR, refresh=False, baseurl=BASEURL, active_ttl=0,
+                 rate_limit=5, rate_burst=10, retries=3, list_cache_dir=None, machine_lists=None):
+        self.token = token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.retries = retries
+        self.cache_dir = cache_dir
+        self.list_cache_dir = list_cache_dir or cache_dir
+        self.shares_lists = self.list_cache_dir != cache_dir
+        self.refresh = refresh
+        self.baseurl = baseurl
+        # indexes already loaded by this client, see get_machine_list()
+        self.machine_lists = {} if machine_lists is None else machine_lists
+        # (timestamp, info) from the last /machine/active, see get_active()
+        self.active_ttl = active_ttl
+        self.active_cache = None
+        # bumped by clear_active(), so an answer fetched before a spawn/kill/reset can tell it's out of date
+        # (see save_active_from())
+        self.active_generation = 0
+        self.active_lock = threading.Lock()
+        # GETs already sent (or being sent) during the current command, see get_body()
+        # None means nothing gets memoized, run_command() turns it on for each command
+        self.memo = None
+        self.memo_lock = threading.Lock()
+        # marks the threads running a concurrently() func, see concurrently()
+        self.worker = threading.local()
+        # guards the writeup ETag file, see remember_writeup_etag()
+        self.etag_lock = threading.Lock()
+        # every request goes through one session so the TCP + TLS connection to HTB gets reused
+        # instead of doing a fresh handshake for every single call
+        # it gets made by the first request (see get_session()), so commands the caches can answer never import requests
+        self.session = None
+        self.session_lock = threading.Lock()
+        # one dict per request sent and per cache lookup, see send() and record_cache()
+        self.spans = []
+        # bytes HTB didn't have to send bc a cached response was still good
+        self.bytes_saved = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.session:
+            self.session.close()
+
+    # the pooled session, made the first time it's needed
+    def get_session(self):
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                session = requests.Session()
+                session.headers.update({
+                    'Authorization': f'Bearer {self.token}',
+                    'User-Agent': 'bruh'
+                    })
+                adapter = traced_adapter()
+                session.mount('https://', adapter(pool_connections=1, pool_maxsize=self.pool_size))
+                session.mount('http://', adapter(pool_connections=1, pool_maxsize=self.pool_size))
+                self.session = session
+            return self.session
+
+    # listing all methods right here for sanity's sake
+    # get(): send GET request to the API, return json
+    # post(): send POST request to the API, return json
+    # send(): actually send a request through the shared session, retrying when it's safe
+    # get_session(): the shared session, made by the first request
+    # retry_delay(): how long to wait before retrying
+    # wait_for_rate_limit(): take a token from the shared rate limit bucket
+    # get_body(): get() without parsing the json, deduplicated within a command
+    # fetch_body(): actually get the body
+    # find_in_list(): first item in an endpoint's list matching a condition, without parsing the rest
+    # cached_body(): get_body() for endpoints in RESPONSE_CACHE
+    # revalidate(): conditional GET for a cached response
+    # load_response() / save_response(): cached responses on disk
+    # index_names(): add a cached machine list response to the completion index
+    # finish_span(): add the body size and total time to a request's span
+    # record_cache(): add a cache hit or miss to the spans
+    # concurrently(): run independent requests at the same time
+    # connection_stats(): count requests and new connections made by the session
+    # get_active(): currently spawned machine, or None
+    # load_active() / save_active() / clear_active(): the active machine cached on disk
+    # save_active_from(): save an active machine fetched elsewhere unless it got cleared in the meantime
+    # get_machine(): full data about a machine, its group and reviews
+    # get_reviews(): return review data about a machine
+    # get_machines(): get_machine() for several machines at once
+    # get_todo(): current to-do list
+    # update_todo() / update_todos(): add or remove machines from your to-do list
+    # spawn_machine() / kill_machine() / reset_machine(): manage machine instances
+    # wait_for_machine(): poll the active machine until a spawn is done
+    # wait_until_reachable(): wait until a machine's IP answers on the network
+    # submit_flag() / submit_flags(): submit flags for a machine
+    # update_owned(): put a machine's owned status into the cached lists after an own
+    # download_writeup(): stream a writeup pdf to disk, resuming partial downloads
+    # load_writeup_etags() / remember_writeup_etag(): remember ETags of downloaded writeups
+    # get_ip(): get IP of a machine
+    # get_machine_list(): get a machine list index from the local cache, downloading it if needed
+    # list_filename(): where a machine list index is cached
+    # save_machine_list(): write a machine list index to the cache
+    # load_machine_lists(): load both machine lists before looking up a lot of machines
+    # preload_machine_lists() / machine_lists_cached(): load them only when a batch of lookups is worth it
+    # find_listed_machine(): look up a lab machine by name or id in the cached lists
+    # find_cached_machine(): look up a lab machine only if the lists are already cached
+    # scan_machine_lists(): look up a lab machine in the cached lists without loading them
+    # resolve_id(): turn a machine name or id into an id
+    # open_machine_db(): connect to the sqlite machine index
+    # sync_machine_db(): bring the machine index up to date with the lists
+    # query_machines(): filter and sort machines from the index
+
+    # sends a get request to an endpoint in HTB's API, passing proper headers for auth
+    # return json response as python dict
+    # responses from endpoints in RESPONSE_CACHE can come from the disk cache, see cached_body()
+    # memo=False always sends the request, see get_body()
+    def get(self, endpoint, memo=True):
+        body = self.get_body(endpoint, memo)
+        # just return the regular response if it's not json
+        if not isinstance(body, str):
+            return body
+        return json_loads(body)
+
+    # GETs an endpoint and returns the body as a str without parsing it, or the response if it isn't json
+    # while self.memo is on, an endpoint only gets requested once:
+    # asking for it again (even from another thread while the first request is still going) gets the same body
+    # errors aren't memoized, and any POST clears the memo since it might've changed something
+    # memo=False sends the request anyway (for polling) and memoizes the new body
+    def get_body(self, endpoint, memo=True):
+        # run_command() can swap self.memo out at any time (from the daemon's point of view), so stick with this one
+        memo_dict = self.memo
+        if memo_dict is None:
+            return self.fetch_body(endpoint)
+        from concurrent.futures import Future
+        if not memo:
+            body = self.fetch_body(endpoint)
+            future = Future()
+            future.set_result(body)
+            with self.memo_lock:
+                memo_dict[endpoint] = future
+            return body
+        with self.memo_lock:
+            future = memo_dict.get(endpoint)
+            first = future is None
+            if first:
+                future = memo_dict[endpoint] = Future()
+        if not first:
+            self.record_cache(endpoint, True, 'memo')
+            return future.result()
+        try:
+            body = self.fetch_body(endpoint)
+        except BaseException as e:
+            with self.memo_lock:
+                if memo_dict.get(endpoint) is future:
+                    del memo_dict[endpoint]
+            future.set_exception(e)
+            raise
+        future.set_result(body)
+        return body
+
+    def fetch_body(self, endpoint):
+        for cached_endpoint, (fresh, stale) in RESPONSE_CACHE.items():
+            if endpoint == cached_endpoint or (cached_endpoint.endswith('/') and endpoint.startswith(cached_endpoint)):
+                return self.cached_body(endpoint, fresh, stale)
+        response = self.send('GET', endpoint)
+        self.finish_span(response, len(response.content))
+        if 'json' not in response.headers.get('Content-Type', ''):
+            return response
+        try:
+            return response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            return response
+
+    # GETs a list endpoint ({'info': [...]}) and returns the first machine that match(machine) is True for, or None
+    # the list gets parsed one machine at a time and parsing stops at the match (see iter_json_items())
+    # so the rest of a big list never gets turned into dicts
+    def find_in_list(self, endpoint, match):
+        body = self.get_body(endpoint)
+        if not isinstance(body, str):
+            return None
+        return next((machine for machine in iter_json_items([body], 'info') if match(machine)), None)
+
+    # get_body() with a disk cache in front of it
+    # fresh and stale are how long the cached response can be used as is, and then while it's revalidated in the background
+    # refresh skips the cache but still sends the validators, so an unchanged response is still just a 304
+    def cached_body(self, endpoint, fresh, stale):
+        entry = self.load_response(endpoint)
+        if entry and not self.refresh:
+            age = time.time() - entry['fetched']
+            if age < fresh:
+                self.record_cache(endpoint, True, 'disk')
+                return entry['body']
+            if age < fresh + stale:
+                self.record_cache(endpoint, True, 'stale')
+                # not a daemon thread so a short lived script still waits for the refresh before exiting
+                threading.Thread(target=self.revalidate, args=(endpoint, entry, True)).start()
+                return entry['body']
+        return self.revalidate(endpoint, entry)
+
+    # sends a conditional GET for endpoint, using the validators from the cached entry if there is one
+    # a 304 means the cached body is still good, a 200 replaces it
+    # returns the body as a str like get_body()
+    # if a background revalidation fails the cached body is kept as it is
+    def revalidate(self, endpoint, entry, background=False):
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            response = self.send('GET', endpoint, headers=headers)
+        except HTBError:
+            if background:
+                return None
+            raise
+        self.finish_span(response, len(response.content))
+        if response.status_code == 304 and entry:
+            entry['fetched'] = time.time()
+            self.save_response(endpoint, entry)
+            self.bytes_saved += len(entry['body'].encode('utf-8'))
+            self.record_cache(endpoint, True, 'revalidated')
+            self.index_names(endpoint, entry['body'])
+            return entry['body']
+        if 'json' not in response.headers.get('Content-Type', ''):
+            return response
+        try:
+            body = response.content.decode('utf-8')
+        except UnicodeDecodeError:
+            return response
+        if response.status_code == 200:
+            self.record_cache(endpoint, False)
+            self.save_response(endpoint, {
+                'fetched': time.time(),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'body': body
+                })
+            self.index_names(endpoint, body)
+        return body
+
+    # a cached response that's a machine list (the starting point one) goes into the completion index
+    # every time it's downloaded or revalidated, so -m meow is enough for meow to complete
+    def index_names(self, endpoint, body):
+        if endpoint not in MACHINE_DB_SOURCES:
+            return
+        try:
+            self.save_machine_names(endpoint, json_loads(body)['info'])
+        except (ValueError, KeyError, TypeError):
+            pass
+
+    # cached responses live in the cache dir under responses/, one json file per endpoint
+    # {'fetched': timestamp, 'etag': ..., 'last_modified': ..., 'body': response text}
+    def response_filename(self, endpoint):
+        return os.path.join(self.cache_dir, 'responses', endpoint.strip('/').replace('/', '_') + '.json')
+
+    def load_response(self, endpoint):
+        try:
+            with open(self.response_filename(endpoint), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # written to a temp file first, unique per thread since the background refresh might be writing too
+    def save_response(self, endpoint, entry):
+        filename = self.response_filename(endpoint)
+        temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(temp_filename, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_filename, filename)
+
+    # same but for post requests
+    def post(self, endpoint, data=None):
+        with self.memo_lock:
+            if self.memo:
+                self.memo.clear()
+        response = self.send('POST', endpoint, data)
+        self.finish_span(response, len(response.content))
+        try:
+            return json_loads(response.content)
+        except ValueError:
+            return response
+
+    # sends a request through the session (auth headers are already set on it) and returns the raw response
+    # extra headers get added on top of the session's, stream=True leaves the body unread (see download_writeup())
+    # rate limited (429) and failed requests get retried with backoff, but only when it can't do something twice:
+    # GETs always, POSTs (spawn, flags, to-do toggles) only if HTB definitely didn't act on them (429 or couldn't connect)
+    # raises HTBError if there's no token or the request still fails after all the retries
+    def send(self, method, endpoint, data=None, headers=None, stream=False):
+        if not self.token:
+            raise HTBError('no API token found in .env, you need one to make API requests\ninstructions here: https://github.com/anton-3/htb-api')
+        import requests
+        url = self.baseurl + endpoint
+        for attempt in range(self.retries + 1):
+            last_attempt = attempt == self.retries
+            self.wait_for_rate_limit()
+            span = {'type': 'request', 'method': method, 'endpoint': endpoint, 'attempt': attempt + 1, 'new_connection': False}
+            self.spans.append(span)
+            TRACE.span = span
+            start = time.perf_counter()
+            try:
+                response = self.get_session().request(method, url, data=data, headers=headers, stream=stream, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                span['error'] = type(e).__name__
+                span['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+                safe = method == 'GET' or never_sent(e)
+                if last_attempt or not safe or not isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+                    if isinstance(e, requests.exceptions.Timeout):
+                        raise HTBError(f'error: {endpoint} timed out')
+                    raise HTBError('error: couldn\'t connect to HackTheBox')
+                time.sleep(self.retry_delay(None, attempt))
+                continue
+
+            finally:
+                TRACE.span = None
+            # requests' elapsed goes up to the response headers, including setting up the connection
+            setup_ms = span.get('dns_ms', 0) + span.get('connect_ms', 0) + span.get('tls_ms', 0)
+            span['status'] = response.status_code
+            span['ttfb_ms'] = round(response.elapsed.total_seconds() * 1000 - setup_ms, 2)
+            response.span = span
+            response.span_start = start
+
+            status = response.status_code
+            # every endpoint answers {'message': 'Unauthenticated.'} for a bad token, which has none of the keys callers expect
+            if status == 401:
+                response.close()
+                raise HTBError('error: HackTheBox rejected the API token, check API_TOKEN in .env')
+            if status == 429 or status >= 500:
+                if not last_attempt and (status == 429 or method == 'GET'):
+                    response.close()
+                    time.sleep(self.retry_delay(response, attempt))
+                    continue
+                raise HTBError(f'error: HackTheBox returned {status} for {endpoint}')
+            return response
+
+    # call once the body of a response from send() has been read
+    def finish_span(self, response, size):
+        response.span['bytes'] = size
+        response.span['total_ms'] = round((time.perf_counter() - response.span_start) * 1000, 2)
+
+    # notes a cache lookup in the spans, hit is True or False
+    def record_cache(self, endpoint, hit, where=None):
+        span = {'type': 'cache', 'endpoint': endpoint, 'cache': 'hit' if hit else 'miss'}
+        if where:
+            span['where'] = where
+        self.spans.append(span)
+
+    # seconds to wait before retrying, honoring Retry-After if HTB sent one (raises HTBError past MAX_RETRY_DELAY)
+    # otherwise exponential backoff (1, 2, 4... seconds, max MAX_RETRY_DELAY) with jitter so parallel requests don't retry in lockstep
+    def retry_delay(self, response, attempt):
+        import random
+        from email.utils import parsedate_to_datetime
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(0, float(retry_after))
+            except ValueError:
+                try:
+                    delay = max(0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                if delay > MAX_RETRY_DELAY:
+                    raise HTBError(f'error: HackTheBox is rate limiting, it says to try again in {delay:.0f}s')
+                return delay
+        delay = min(MAX_RETRY_DELAY, 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    # token bucket rate limiter, the bucket lives in a file in the cache dir so every process
+    # (and every thread) using it shares the same limit
+    # the file just holds "tokens timestamp", flock keeps updates to it atomic
+    # a request that finds the bucket empty takes a token anyway (going negative) and sleeps until it's paid back
+    def wait_for_rate_limit(self):
+        if not self.rate_limit:
+            return
+        filename = os.path.join(self.cache_dir, 'ratelimit')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(filename, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            now = time.time()
+            f.seek(0)
+            try:
+                tokens, updated = map(float, f.read().split())
+            except ValueError:
+                tokens, updated = self.rate_burst, now
+            tokens = min(self.rate_burst, tokens + (now - updated) * self.rate_limit) - 1
+            f.seek(0)
+            f.truncate()
+            f.write(f'{tokens} {now}')
+        if tokens < 0:
+            time.sleep(-tokens / self.rate_limit)
+
+    # runs each function passed in on its own thread and returns their results in the same order
+    # meant for requests that don't depend on each other, e.g.
+    # profile, reviews = client.concurrently(lambda: client.get('/machine/profile/1'), lambda: client.get_reviews(1))
+    # at most pool_size run at once so every thread can get a pooled connection
+    # a func that calls concurrently() itself (get_machines() -> get_machine()) runs those one after another,
+    # the outer call already keeps pool_size requests going and more threads would just open more connections
+    def concurrently(self, *funcs):
+        if getattr(self.worker, 'busy', False):
+            return [func() for func in funcs]
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(func):
+            self.worker.busy = True
+            try:
+                return func()
+            finally:
+                self.worker.busy = False
+        with ThreadPoolExecutor(max_workers=min(len(funcs), self.pool_size)) as executor:
+            futures = [executor.submit(run, func) for func in funcs]
+            return [future.result() for future in futures]
+
+    # returns (requests, new connections) sent through the session so far
+    # every new connection to HTB is a full TCP + TLS handshake, everything else reused one
+    def connection_stats(self):
+        total_requests = 0
+        total_connections = 0
+        if not self.session:
+            return 0, 0
+        for adapter in self.session.adapters.values():
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                total_requests += pools[key].num_requests
+                total_connections += pools[key].num_connections
+        return total_requests, total_connections
+
+    # GET /machine/active
+    # returns the currently spawned machine ({'id', 'name', 'expires_at', ...}) or None
+    # reuses the last answer if it's younger than active_ttl, unless force=True (or refresh)
+    # the last answer is also saved as active.json in the cache dir, so the next run of the script can use it
+    # spawning, killing and resetting throw the saved answer away
+    def get_active(self, force=False):
+        if not force and not self.refresh and self.active_ttl:
+            where = 'memory'
+            if not self.active_cache:
+                self.active_cache = self.load_active()
+                where = 'disk'
+            if self.active_cache and time.time() - self.active_cache[0] < self.active_ttl:
+                self.record_cache('/machine/active', True, where)
+                return self.active_cache[1]
+        info = self.get('/machine/active', memo=not force)['info']
+        self.save_active(info)
+        return info
+
+    def active_filename(self):
+        return os.path.join(self.cache_dir, 'active.json')
+
+    # (timestamp, info) from active.json, or None
+    def load_active(self):
+        try:
+            with open(self.active_filename(), 'r') as f:
+                cached = json.load(f)
+            return cached['fetched'], cached['info']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save_active(self, info):
+        self.active_cache = (time.time(), info)
+        filename = self.active_filename()
+        temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(temp_filename, 'w') as f:
+            json.dump({'fetched': self.active_cache[0], 'info': info}, f)
+        os.replace(temp_filename, filename)
+
+    # forgets the active machine, in memory and on disk
+    def clear_active(self):
+        with self.active_lock:
+            self.active_generation += 1
+            self.active_cache = None
+            try:
+                os.remove(self.active_filename())
+            except OSError:
+                pass
+
+    # save_active() for an answer that was fetched while generation was active_generation
+    # (from somewhere else, like the daemon's refresh), dropped if the active machine got cleared since
+    # returns True if it was saved
+    def save_active_from(self, generation, info):
+        with self.active_lock:
+            if generation != self.active_generation:
+                return False
+            self.save_active(info)
+            return True
+
+    # GET /machine/profile/name_or_id OR /sp/machines
+    # returns (machine, group, reviews) or None if there's no such machine
+    # group is 'active', 'retired', or 'starting_point'
+    # reviews is a list, or None if we don't have access to them (always None for starting point)
+    # we can get the data directly if it's a lab machine (active or retired)
+    # if it's a starting point machine, we need to make a second request
+    def get_machine(self, name_or_id):
+        name_or_id = str(name_or_id)
+        # look a name up in the lists so we know the id before asking for the profile
+        # but only if they're cached, downloading them costs a lot more than the reviews request it saves
+        if name_or_id.isnumeric():
+            m_id = int(name_or_id)
+        else:
+            listed = self.find_cached_machine(name_or_id)
+            m_id = listed['id'] if listed else None
+        if m_id:
+            # once we have the id the profile and the reviews don't depend on each other
+            # so send both requests at the same time
+            response, reviews = self.concurrently(lambda: self.get(f'/machine/profile/{m_id}'), lambda: self.get_reviews(m_id))
+        else:
+            # otherwise just make the same request with the arg (starting point or a brand new machine)
+            response = self.get('/machine/profile/' + name_or_id)
+            reviews = None
+        # if the request found a matching machine (either in active or retired)
+        if 'info' in response:
+            machine = response['info']
+            if not m_id:
+                reviews = self.get_reviews(machine['id'])
+            group = 'retired' if machine['retired'] == 1 else 'active'
+            return machine, group, reviews
+        elif response.get('message') == 'Starting Point Machine':
+            machine = self.find_in_list('/sp/machines', lambda machine: name_or_id.lower() == machine['name'].lower() or name_or_id == str(machine['id']))
+            # if it's not there then the API data is inaccurate, just say there's no such machine
+            if machine:
+                return machine, 'starting_point', None
+
+    # get and return review data for a machine given its id
+    # None if we don't have access to the reviews
+    def get_reviews(self, machine_id):
+        review_data = self.get('/machine/reviews/' + str(machine_id))['message']
+        # if it's a str it'll be 'You do not have access to the reviews'
+        if type(review_data) == str:
+            return None
+        return review_data
+
+    # GET /machine/todo
+    # returns the machines in your to-do list
+    def get_todo(self):
+        return self.get('/machine/todo')['info']
+
+    # get_machine() for several machines at once
+    # the machine lists get loaded up front if it's worth it (see preload_machine_lists())
+    # and the machines are fetched at the same time (pool_size at most)
+    # returns the results in the same order as names_or_ids
+    def get_machines(self, names_or_ids):
+        if not names_or_ids:
+            return []
+        self.preload_machine_lists(names_or_ids)
+        return self.concurrently(*(lambda name_or_id=name_or_id: self.get_machine(name_or_id) for name_or_id in names_or_ids))
+
+    # POST /machine/todo/update/id
+    # adds or removes a machine from your to-do list
+    # returns 'added' or 'removed', or None if there's no such machine
+    def update_todo(self, name_or_id):
+        return self.update_todos([name_or_id])[0]
+
+    # update_todo() for several machines at once, returns the results in the same order as names_or_ids
+    # HTB sends back the whole to-do list after each update, so whether a machine got added or removed
+    # is just whether it's in there (no need to get the list first)
+    # a machine that's passed twice only gets toggled once
+    def update_todos(self, names_or_ids):
+        if not names_or_ids:
+            return []
+        # we need the ids to update the to-do list, names get looked up in the machine lists if they're cached
+        # (or worth downloading for a big batch) and with /machine/profile otherwise
+        self.preload_machine_lists(names_or_ids)
+        ids = self.concurrently(*(lambda name_or_id=name_or_id: self.resolve_id(name_or_id, download=False) for name_or_id in names_or_ids))
+        unique_ids = list(dict.fromkeys(m_id for m_id in ids if m_id))
+
+        def update(m_id):
+            todo_response = self.post(f'/machine/todo/update/{m_id}')
+            # if it didn't find the machine
+            if 'info' not in todo_response:
+                return None
+            return 'added' if any(machine['id'] == m_id for machine in todo_response['info']) else 'removed'
+        results = dict(zip(unique_ids, self.concurrently(*(lambda m_id=m_id: update(m_id) for m_id in unique_ids)))) if unique_ids else {}
+        return [results.get(m_id) for m_id in ids]
+
+    # POST /vm/spawn {'machine_id': 123}
+    # returns HTB's message, 'Machine deployed to lab.' if it worked
+    def spawn_machine(self, m_id):
+        self.clear_active()
+        return self.post('/vm/spawn', {'machine_id': m_id})['message']
+
+    # polls GET /machine/active (and only that) until machine m_id is the active one and done spawning
+    # the wait between polls starts short and backs off (see SPAWN_POLL), since small machines are often up in seconds
+    # returns (info, polls), info is None if it's still not up after timeout seconds
+    def wait_for_machine(self, m_id, timeout=SPAWN_TIMEOUT):
+        deadline = time.time() + timeout
+        delay, factor, max_delay = SPAWN_POLL
+        polls = 0
+        while True:
+            info = self.get_active(force=True)
+            polls += 1
+            if info and info['id'] == m_id and not info.get('isSpawning'):
+                return info, polls
+            if time.time() + delay > deadline:
+                return None, polls
+            time.sleep(delay)
+            delay = min(delay * factor, max_delay)
+
+    # tries to connect to ip on PROBE_PORTS until one of them answers (even with a refusal)
+    # returns True once it does, False if it doesn't within timeout seconds
+    # the machine's IP is only reachable over the HTB VPN, so this says nothing if that isn't connected
+    def wait_until_reachable(self, ip, timeout=SPAWN_TIMEOUT):
+        deadline = time.time() + timeout
+        delay, factor, max_delay = SPAWN_POLL
+        while True:
+            for port in PROBE_PORTS:
+                try:
+                    socket.create_connection((ip, port), timeout=min(delay, 3)).close()
+                    return True
+                except ConnectionRefusedError:
+                    return True
+                except OSError:
+                    pass
+            if time.time() + delay > deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * factor, max_delay)
+
+    # POST /vm/terminate {'machine_id': 123}
+    # for some reason we need to pass the ID of the machine we're killing
+    def kill_machine(self, m_id):
+        self.clear_active()
+        return self.post('/vm/terminate', {'machine_id': m_id})['message']
+
+    # POST /vm/reset {'machine_id': 123}
+    def reset_machine(self, m_id):
+        self.clear_active()
+        return self.post('/vm/reset', {'machine_id': m_id})['message']
+
+    # submit_flag() for several flags (like the user and root flag), one after the other in that order
+    # returns a (status, message) for each flag
+    def submit_flags(self, m_id, flags, difficulty):
+        results = [self.submit_flag(m_id, flag, difficulty, update_owned=False) for flag in flags]
+        if any(status == 200 for status, _ in results):
+            self.update_owned(m_id)
+        return results
+
+    # POST /machine/own {'flag': flag, 'id': 123, 'difficulty': 50}
+    # difficulty is 1-10, the actual endpoint expects 10-100
+    # an accepted flag changes what you own, so the cached lists get updated (see update_owned())
+    # returns (status, message)
+    def submit_flag(self, m_id, flag, difficulty, update_owned=True):
+        data = {}
+        data['flag'] = flag
+        data['id'] = m_id
+        data['difficulty'] = difficulty * 10
+        submit_response = self.post('/machine/own', data)
+        if update_owned and submit_response['status'] == 200:
+            self.update_owned(m_id)
+        return submit_response['status'], submit_response['message']
+
+    # the lists (and the machine index built from them) are only redownloaded every few hours or days,
+    # so after an own they'd say you don't own the machine for that long, and --unowned would keep listing it
+    # this gets the machine's owned status from its profile and writes it into the cached list and the index
+    # (just the index for lists shared between accounts, see PER_USER_FIELDS)
+    # the list keeps its age, it's still only as current as it was otherwise
+    # if that doesn't work out, the lists just catch up when they get redownloaded
+    def update_owned(self, m_id):
+        try:
+            profile = self.get(f'/machine/profile/{m_id}').get('info')
+        except HTBError:
+            return
+        if not profile:
+            return
+        owned = {key: profile.get(key) for key in ('authUserInUserOwns', 'authUserInRootOwns')}
+        # shared lists don't have anyone's owned flags, only this client's machines.db does
+        for endpoint in (() if self.shares_lists else LIST_TTLS):
+            filename = self.list_filename(endpoint)
+            index = self.machine_lists.get(endpoint)
+            try:
+                if not index:
+                    with open(filename, 'r') as f:
+                        index = json_loads(f.read())
+                machine = index['by_id'].get(str(m_id))
+                if not machine:
+                    continue
+                machine.update(owned)
+                fetched = os.path.getmtime(filename)
+                self.save_machine_list(endpoint, index)
+                os.utime(filename, (fetched, fetched))
+            except (OSError, ValueError, KeyError):
+                continue
+            break
+        if not os.path.exists(os.path.join(self.cache_dir, 'machines.db')):
+            return
+        db = self.open_machine_db()
+        try:
+            with db:
+                rows = db.execute("SELECT machine_group, data FROM machines WHERE id = ? AND machine_group != 'starting_point'", (m_id,)).fetchall()
+                for group, data in rows:
+                    data = json.dumps(dict(json.loads(data), **owned), sort_keys=True)
+                    db.execute('UPDATE machines SET user_owned = ?, root_owned = ?, data = ? WHERE machine_group = ? AND id = ?',
+                               (bool(owned['authUserInUserOwns']), bool(owned['authUserInRootOwns']), data, group, m_id))
+        finally:
+            db.close()
+
+    # downloads the writeup for machine m_id to filename, streaming it to disk in chunks
+    # so the whole pdf never sits in memory
+    # the data goes to filename.part first and gets renamed once it's complete,
+    # a leftover .part file from an interrupted download gets resumed with a Range request
+    # if filename already exists and matches what HTB has (ETag or size) nothing is downloaded
+    # progress gets called as progress(done, total, downloaded, elapsed) after every chunk
+    # returns the number of bytes downloaded (for a .part that was already complete, its size), 0 if filename is already
+    # up to date, or None if HTB doesn't have a writeup
+    def download_writeup(self, m_id, filename, progress=None):
+        part_filename = filename + '.part'
+        etag = self.load_writeup_etags().get(str(m_id))
+        headers = {}
+        resume_from = 0
+        if os.path.exists(filename):
+            if etag:
+                headers['If-None-Match'] = etag
+        elif os.path.exists(part_filename):
+            resume_from = os.path.getsize(part_filename)
+            headers['Range'] = f'bytes={resume_from}-'
+            # only resume if the writeup hasn't changed since the partial download started
+            if etag:
+                headers['If-Range'] = etag
+
+        response = self.send('GET', f'/machine/writeup/{m_id}', headers=headers, stream=True)
+        with response:
+            # bytes/total time for --trace only cover what actually gets read
+            self.finish_span(response, 0)
+            if response.status_code == 304:
+                return 0
+            # the .part file is already complete (interrupted right before the rename), just finish it
+            # unless the size the server gives doesn't match, then it's from some other version, start over
+            if response.status_code == 416 and resume_from:
+                complete_size = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if complete_size.isdigit() and int(complete_size) != resume_from:
+                    os.remove(part_filename)
+                    return self.download_writeup(m_id, filename, progress)
+                os.replace(part_filename, filename)
+                # nothing new came over the network, but the file did just get finished, so it's not 'already up to date'
+                if progress:
+                    progress(resume_from, resume_from, 0, 0)
+                return resume_from
+            if response.status_code not in (200, 206) or 'json' in response.headers.get('Content-Type', ''):
+                return None
+            total = int(response.headers.get('Content-Length', 0))
+            # no ETag to compare with, so the best we can do is check the size
+            if os.path.exists(filename) and response.status_code == 200 and total == os.path.getsize(filename):
+                return 0
+            if response.headers.get('ETag'):
+                self.remember_writeup_etag(m_id, response.headers['ETag'])
+            if response.status_code == 206:
+                mode = 'ab'
+                total += resume_from
+            else:
+                # server sent the whole thing (no range support or the writeup changed), start over
+                mode = 'wb'
+                resume_from = 0
+
+            downloaded = 0
+            start = time.time()
+            with open(part_filename, mode) as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    f.write(chunk)
+                    downloaded += len(chunk)
+                    if progress:
+                        progress(resume_from + downloaded, total, downloaded, time.time() - start)
+            self.finish_span(response, downloaded)
+        os.replace(part_filename, filename)
+        return downloaded
+
+    # ETags of downloaded writeups by machine id, kept in the cache dir
+    # used by download_writeup() to tell if a local copy is still current
+    def load_writeup_etags(self):
+        try:
+            with open(os.path.join(self.cache_dir, 'writeup_etags.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # saves the ETag for one writeup
+    # locked bc mirror_writeups() downloads several at once and they'd overwrite each other's
+    def remember_writeup_etag(self, m_id, etag):
+        filename = os.path.join(self.cache_dir, 'writeup_etags.json')
+        with self.etag_lock:
+            etags = self.load_writeup_etags()
+            etags[str(m_id)] = etag
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(filename + '.tmp', 'w') as f:
+                json.dump(etags, f)
+            os.replace(filename + '.tmp', filename)
+
+    # gets IP of machine given its name or ID, None if it isn't a lab machine
+    # for some godforsaken reason the only way I know of to get a machine's IP
+    # is to query for literally every machine and select for the correct IP
+    # so the machine lists are cached on disk and indexed, see get_machine_list()
+    # only works for lab machines (either active or retired)
+    def get_ip(self, name_or_id):
+        # no redownloading the lists for a machine that isn't in them, it's usually a starting point one
+        machine = self.find_listed_machine(name_or_id, retry=False)
+        if machine:
+            return machine['ip']
+
+    # returns the index for a machine list endpoint ('/machine/list' or '/machine/list/retired')
+    # the index is a dict like {'fetched': timestamp, 'by_id': {'1': machine}, 'by_name': {'lame': '1'},
+    # 'etag': ..., 'last_modified': ..., 'size': bytes of the list response}
+    # it gets read from the cache dir if it's younger than its TTL, otherwise downloaded and saved
+    # force=True (or refresh) skips the cache, but an index that's too old (or skipped) still sends its
+    # ETag/Last-Modified, so if the list hasn't changed HTB answers 304 and the index just gets used again
+    # indexes are also kept in self.machine_lists so the file only gets parsed once
+    def get_machine_list(self, endpoint, force=False):
+        index = self.machine_lists.get(endpoint)
+        if not force and index and time.time() - index['fetched'] < LIST_TTLS[endpoint]:
+            self.record_cache(endpoint, True, 'memory')
+            return index
+        filename = self.list_filename(endpoint)
+        try:
+            with open(filename, 'r') as f:
+                index = json_loads(f.read())
+            # a 304 only touches the file, so its mtime is when the list was last known to be current
+            index['fetched'] = max(index['fetched'], os.path.getmtime(filename))
+            if not force and not self.refresh and time.time() - index['fetched'] < LIST_TTLS[endpoint]:
+                self.machine_lists[endpoint] = index
+                self.record_cache(endpoint, True, 'disk')
+                return index
+        # missing or corrupted cache file, just redownload it
+        except (OSError, ValueError, KeyError):
+            index = None
+
+        headers = {}
+        if index and index.get('etag'):
+            headers['If-None-Match'] = index['etag']
+        if index and index.get('last_modified'):
+            headers['If-Modified-Since'] = index['last_modified']
+        response = self.send('GET', endpoint, headers=headers)
+        self.finish_span(response, len(response.content))
+        if response.status_code == 304 and index:
+            os.utime(filename)
+            index['fetched'] = time.time()
+            self.bytes_saved += index.get('size', 0)
+            self.record_cache(endpoint, True, 'revalidated')
+            self.machine_lists[endpoint] = index
+            return index
+
+        self.record_cache(endpoint, False)
+        list_info = json_loads(response.content)['info']
+        if self.shares_lists:
+            list_info = [{key: value for key, value in machine.items() if key not in PER_USER_FIELDS} for machine in list_info]
+        index = {
+                'fetched': time.time(),
+                'by_id': {str(machine['id']): machine for machine in list_info},
+                'by_name': {machine['name'].lower(): str(machine['id']) for machine in list_info},
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'size': len(response.content)
+                }
+        self.save_machine_list(endpoint, index)
+        self.machine_lists[endpoint] = index
+        self.save_machine_names(endpoint, list_info)
+        return index
+
+    # writes an index to the list cache
+    # to a temp file that gets renamed so a ctrl C can't leave half a cache file behind
+    # (unique per thread, other accounts' clients might be writing the same list)
+    def save_machine_list(self, endpoint, index):
+        filename = self.list_filename(endpoint)
+        temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(self.list_cache_dir, exist_ok=True)
+        with open(temp_filename, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_filename, filename)
+
+    # gets both lists into self.machine_lists (at the same time if they need downloading)
+    # so looking up a lot of machines afterwards doesn't scan the cache files for each one
+    def load_machine_lists(self):
+        self.concurrently(*(lambda endpoint=endpoint: self.get_machine_list(endpoint) for endpoint in LIST_TTLS))
+
+    # load_machine_lists() before looking up a batch of machines, but only when it saves something:
+    # ids don't need the lists, cached lists only need parsing (one name is quicker to scan for, see scan_machine_lists()),
+    # and downloading them only beats a /machine/profile lookup per name for LIST_PRELOAD_BATCH names or more
+    # with refresh the lookups don't use the lists anyway (see find_cached_machine())
+    def preload_machine_lists(self, names_or_ids):
+        if self.refresh:
+            return
+        names = {str(name_or_id).lower() for name_or_id in names_or_ids if not str(name_or_id).isnumeric()}
+        if len(names) >= LIST_PRELOAD_BATCH or (len(names) > 1 and self.machine_lists_cached()):
+            self.load_machine_lists()
+
+    # whether both lists are fresh in memory or in the cache files, without reading the files
+    def machine_lists_cached(self):
+        for endpoint, ttl in LIST_TTLS.items():
+            index = self.machine_lists.get(endpoint)
+            if index and time.time() - index['fetched'] < ttl:
+                continue
+            try:
+                if time.time() - os.path.getmtime(self.list_filename(endpoint)) >= ttl:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def list_filename(self, endpoint):
+        return os.path.join(self.list_cache_dir, endpoint.strip('/').replace('/', '_') + '.json')
+
+    # writes the shell completion index for one source in MACHINE_DB_SOURCES, see complete_machine_names()
+    # called whenever a list gets downloaded (or for starting point, revalidated, see index_names())
+    def save_machine_names(self, endpoint, machines):
+        filename = names_filename(self.list_cache_dir, endpoint)
+        temp_filename = f'{filename}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(temp_filename, 'w') as f:
+            f.writelines(sorted(f'{machine["name"].lower()}\t{machine["name"]}\n' for machine in machines))
+        os.replace(temp_filename, filename)
+
+    # finds a lab machine (active or retired) by name or id in the cached machine lists
+    # returns the machine's list entry, or None if it isn't in either list
+    # if it's not found in the cache, the lists get redownloaded once in case it's a brand new machine
+    # (unless retry=False)
+    def find_listed_machine(self, name_or_id, retry=True):
+        key = str(name_or_id).lower()
+        for force in ((False, True) if retry else (False,)):
+            # one machine out of fresh cache files doesn't need the whole lists loaded
+            scanned = None if force or self.refresh else self.scan_machine_lists(key)
+            if scanned:
+                return scanned
+            # None means a list wasn't cached, False means they were and the machine isn't in them
+            if scanned is None:
+                # if both lists need downloading, download them at the same time
+                indexes = self.concurrently(*(lambda endpoint=endpoint: self.get_machine_list(endpoint, force) for endpoint in LIST_TTLS))
+                for index in indexes:
+                    m_id = key if key in index['by_id'] else index['by_name'].get(key)
+                    if m_id:
+                        return index['by_id'][m_id]
+            # no point downloading again if we just did
+            if self.refresh:
+                break
+
+    # find_listed_machine() that never downloads the lists, for when the lookup is only there to save a request
+    # returns the machine's list entry, or None if it isn't in the cached lists (or they aren't cached)
+    def find_cached_machine(self, name_or_id):
+        if self.refresh:
+            return None
+        return self.scan_machine_lists(str(name_or_id).lower()) or None
+
+    # looks key (a lowercase name or id) up in the cached lists without loading them into indexes
+    # lists already in self.machine_lists get used directly, cache files on disk get parsed a machine at a time
+    # until the machine turns up (see iter_json_items()), so a -a or -S doesn't parse thousands of retired machines
+    # returns the machine, False if every list was cached and it's not in any of them,
+    # or None if a list isn't cached (or is too old) and get_machine_list() needs to take over
+    def scan_machine_lists(self, key):
+        for endpoint in LIST_TTLS:
+            index = self.machine_lists.get(endpoint)
+            if index and time.time() - index['fetched'] < LIST_TTLS[endpoint]:
+                self.record_cache(endpoint, True, 'memory')
+                m_id = key if key in index['by_id'] else index['by_name'].get(key)
+                if m_id:
+                    return index['by_id'][m_id]
+                continue
+            filename = self.list_filename(endpoint)
+            try:
+                # the file gets replaced whenever the list is downloaded, so its mtime is when it was fetched
+                if time.time() - os.path.getmtime(filename) >= LIST_TTLS[endpoint]:
+                    return None
+                with open(filename, 'r') as f:
+                    chunks = iter(lambda: f.read(64 * 1024), '')
+                    self.record_cache(endpoint, True, 'disk')
+                    for m_id, machine in iter_json_items(chunks, 'by_id'):
+                        if m_id == key or machine['name'].lower() == key:
+                            return machine
+            except (OSError, ValueError, KeyError):
+                return None
+        return False
+
+    # turns a machine name or id into its id without a /machine/profile request if possible
+    # falls back to /machine/profile for machines that aren't in the lists (starting point)
+    # download=False only uses the lists if they're already cached, for when one profile request is cheaper
+    # returns None if there's no such machine
+    def resolve_id(self, name_or_id, download=True):
+        name_or_id = str(name_or_id)
+        if name_or_id.isnumeric():
+            return int(name_or_id)
+        machine = self.find_listed_machine(name_or_id, retry=False) if download else self.find_cached_machine(name_or_id)
+        if machine:
+            return machine['id']
+        info_response = self.get('/machine/profile/' + name_or_id)
+        if 'info' in info_response:
+            return info_response['info']['id']
+
+    # the machine index lives in the cache dir as machines.db
+    # one row per machine, with indexes on everything --list filters or sorts by
+    # `synced` has when each source in MACHINE_DB_SOURCES was last written to it
+    # a new connection every time bc sqlite connections can't be shared between threads (the daemon)
+    def open_machine_db(self):
+        import sqlite3
+        os.makedirs(self.cache_dir, exist_ok=True)
+        db = sqlite3.connect(os.path.join(self.cache_dir, 'machines.db'), timeout=10)
+        db.executescript('''
+            CREATE TABLE IF NOT EXISTS machines (
+                id INTEGER,
+                machine_group TEXT,
+                name TEXT,
+                os TEXT,
+                difficulty TEXT,
+                difficulty_rank INTEGER,
+                difficulty_rating INTEGER,
+                stars REAL,
+                release TEXT,
+                user_owns INTEGER,
+                user_owned INTEGER,
+                root_owned INTEGER,
+                data TEXT,
+                PRIMARY KEY (machine_group, id)
+            );
+            CREATE TABLE IF NOT EXISTS synced (source TEXT PRIMARY KEY, fetched REAL);
+            CREATE INDEX IF NOT EXISTS machines_os ON machines (os COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS machines_difficulty ON machines (difficulty COLLATE NOCASE);
+            CREATE INDEX IF NOT EXISTS machines_difficulty_rank ON machines (difficulty_rank, difficulty_rating);
+            CREATE INDEX IF NOT EXISTS machines_stars ON machines (stars);
+            CREATE INDEX IF NOT EXISTS machines_release ON machines (release);
+            CREATE INDEX IF NOT EXISTS machines_user_owns ON machines (user_owns);
+            CREATE INDEX IF NOT EXISTS machines_owned ON machines (root_owned, user_owned);
+            ''')
+        return db
+
+    # updates the machine index from every source in MACHINE_DB_SOURCES that's older than its TTL
+    # the lab lists come from get_machine_list(), so a fresh list cache doesn't cost a request
+    # only machines that changed get rewritten and machines that left a list get deleted from it
+    # force=True (or refresh) syncs everything
+    def sync_machine_db(self, force=False):
+        db = self.open_machine_db()
+        try:
+            synced = dict(db.execute('SELECT source, fetched FROM synced'))
+            stale = [endpoint for endpoint, (group, ttl) in MACHINE_DB_SOURCES.items()
+                     if force or self.refresh or time.time() - synced.get(endpoint, 0) >= ttl]
+            if not stale:
+                self.record_cache('machines.db', True, 'index')
+                return
+
+            def fetch(endpoint):
+                if endpoint in LIST_TTLS:
+                    index = self.get_machine_list(endpoint, force)
+                    return index['fetched'], index['by_id'].values()
+                return time.time(), self.get(endpoint)['info']
+            # downloading (or parsing) the lists is the slow part, do them at the same time
+            results = self.concurrently(*(lambda endpoint=endpoint: fetch(endpoint) for endpoint in stale))
+
+            with db:
+                for endpoint, (fetched, machines) in zip(stale, results):
+                    group = MACHINE_DB_SOURCES[endpoint][0]
+                    rows = []
+                    for machine in machines:
+                        difficulty_text = machine.get('difficultyText')
+                        rows.append((
+                            machine['id'], group, machine['name'], machine.get('os'), difficulty_text,
+                            DIFFICULTY_TEXTS.index(difficulty_text) if difficulty_text in DIFFICULTY_TEXTS else len(DIFFICULTY_TEXTS),
+                            machine.get('difficulty'), float(machine['stars']) if machine.get('stars') else None,
+                            machine.get('release'), machine.get('user_owns_count'),
+                            bool(machine.get('authUserInUserOwns')), bool(machine.get('authUserInRootOwns')),
+                            json.dumps(machine, sort_keys=True)
+                            ))
+                    # shared lists don't say who owns what, so they leave the owned flags update_owned() wrote alone
+                    owned_columns = '' if self.shares_lists else 'user_owned = excluded.user_owned, root_owned = excluded.root_owned, '
+                    db.executemany(f'''
+                        INSERT INTO machines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (machine_group, id) DO UPDATE SET
+                            name = excluded.name, os = excluded.os, difficulty = excluded.difficulty,
+                            difficulty_rank = excluded.difficulty_rank, difficulty_rating = excluded.difficulty_rating,
+                            stars = excluded.stars, release = excluded.release, user_owns = excluded.user_owns,
+                            {owned_columns}data = excluded.data
+                        WHERE data IS NOT excluded.data
+                        ''', rows)
+                    # machines that aren't in the list anymore (like ones that just retired)
+                    listed = {row[0] for row in rows}
+                    existing = {m_id for m_id, in db.execute('SELECT id FROM machines WHERE machine_group = ?', (group,))}
+                    db.executemany('DELETE FROM machines WHERE machine_group = ? AND id = ?', ((group, m_id) for m_id in existing - listed))
+                    db.execute('INSERT OR REPLACE INTO synced VALUES (?, ?)', (endpoint, fetched))
+        finally:
+            db.close()
+
+    # returns machines from the index matching every filter that's given, sorted by one of MACHINE_SORTS
+    # group is 'active', 'retired' or 'starting_point', machine_os and difficulty are matched ignoring case
+    # unowned=True leaves out machines you already have root on
+    # each machine is a dict with the same keys as in the machine lists plus 'group', but only the indexed ones
+    # (the whole list entry is in the data column)
+    def query_machines(self, group=None, machine_os=None, difficulty=None, unowned=False, sort='name'):
+        self.sync_machine_db()
+        where = []
+        params = []
+        if group:
+            where.append('machine_group = ?')
+            params.append(group)
+        if machine_os:
+            where.append('os = ? COLLATE NOCASE')
+            params.append(machine_os)
+        if difficulty:
+            where.append('difficulty = ? COLLATE NOCASE')
+            params.append(difficulty)
+        if unowned:
+            where.append('root_owned = 0')
+        query = ('SELECT id, machine_group AS "group", name, os, difficulty AS difficultyText, difficulty_rating AS difficulty, stars, release, '
+                 'user_owns AS user_owns_count, user_owned AS authUserInUserOwns, root_owned AS authUserInRootOwns FROM machines'
+                 + (' WHERE ' + ' AND '.join(where) if where else '') + ' ORDER BY ' + MACHINE_SORTS[sort])
+        db = self.open_machine_db()
+        try:
+            cursor = db.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            machines = [dict(zip(columns, row)) for row in cursor]
+            # sqlite hands booleans back as 0/1
+            for machine in machines:
+                machine['authUserInUserOwns'] = bool(machine['authUserInUserOwns'])
+                machine['authUserInRootOwns'] = bool(machine['authUserInRootOwns'])
+            return machines
+        finally:
+            db.close()
+
+# yields what's in the list or dict under key in a json object, parsing it as it goes
+# chunks is an iterable of str pieces of the json (a file read in blocks, or just [text])
+# lists give their items and dicts give (key, value) pairs
+# if the caller stops early, the rest never gets parsed (or read)
+def iter_json_items(chunks, key):
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+    pos = 0
+
+    # reads the next chunk onto the buffer, dropping what's already been parsed
+    # returns False if there's nothing left
+    def read_more():
+        nonlocal buffer, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    # returns the next character that isn't whitespace, without consuming it
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                raise ValueError('unexpected end of json')
+
+    def expect(char):
+        nonlocal pos
+        if peek() != char:
+            raise ValueError(f'expected {char!r} in json')
+        pos += 1
+
+    def skip_comma():
+        nonlocal pos
+        if peek() == ',':
+            pos += 1
+
+    # decodes the value at pos, reading more chunks until it's all there
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not read_more():
+                    raise
+                continue
+            # a number cut off by the end of a chunk parses as a shorter number (1.5 as 1, 1e3 as 1, 123 as 12)
+            if (end == len(buffer) or buffer[end] in '.eE+-') and read_more():
+                continue
+            pos = end
+            return result
+
+    expect('{')
+    while peek() != '}':
+        name = value()
+        expect(':')
+        if name != key:
+            value()
+            skip_comma()
+            continue
+        opening = peek()
+        if opening not in '[{':
+            raise ValueError(f'{key} isn\'t a list or dict')
+        pos += 1
+        closing = ']' if opening == '[' else '}'
+        while peek() != closing:
+            if opening == '{':
+                item_key = value()
+                expect(':')
+                yield item_key, value()
+            else:
+                yield value()
+            skip_comma()
+        return
+
+# the completion index is a small text file per source in MACHINE_DB_SOURCES under names/ in the cache dir,
+# one 'lowercase name<tab>name' line per machine, sorted, so every name starting with a prefix is one bisect away
+# HTBClient.save_machine_names() writes them, nothing here sends a request or needs requests imported
+# so --complete stays fast enough to run on every tab press
+def names_filename(cache_dir, endpoint):
+    return os.path.join(cache_dir, 'names', endpoint.strip('/').replace('/', '_') + '.txt')
+
+# the sorted lines of every source's names file, a list per source (missing ones are skipped)
+def load_machine_names(cache_dir=CACHE_DIR):
+    sources = []
+    for endpoint in MACHINE_DB_SOURCES:
+        try:
+            with open(names_filename(cache_dir, endpoint), 'r') as f:
+                sources.append(f.read().splitlines())
+        except OSError:
+            pass
+    return sources
+
+# machine names starting with prefix, ignoring case, sorted
+# the names keep the case of the prefix so shells that match case-sensitively (bash) still take them
+def complete_machine_names(prefix, cache_dir=CACHE_DIR):
+    from bisect import bisect_left
+    key = prefix.lower()
+    names = set()
+    for lines in load_machine_names(cache_dir):
+        for line in lines[bisect_left(lines, key):]:
+            if not line.startswith(key):
+                break
+            names.add(prefix + line.split('\t', 1)[1][len(prefix):])
+    return sorted(names, key=str.lower)
+
+# up to n machine names that look like name (a typo of one), best match first, for 'did you mean'
+# only knows about machines whose list has been downloaded before
+def suggest_machine_names(name, n=3, cache_dir=CACHE_DIR):
+    from difflib import get_close_matches
+    names = {}
+    for lines in load_machine_names(cache_dir):
+        names.update(line.split('\t', 1) for line in lines)
+    return [names[match] for match in get_close_matches(str(name).lower(), names, n)]
+
+# same thing as HTBClient but every method is a coroutine, for asyncio code
+# the requests themselves still go through HTBClient's session on a worker thread
+# async with AsyncHTBClient(token) as client:
+#     active = await client.get_active()
+class AsyncHTBClient:
+    def __init__(self, *args, **kwargs):
+        self.client = HTBClient(*args, **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.client.close()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+        async def method(*args, **kwargs):
+            import asyncio
+            return await asyncio.to_thread(attr, *args, **kwargs)
+        return method
+
+# functions for the script, they all take the client and print stuff
 
 # listing all functions right here for sanity's sake
-# get(): send GET request to the API, return json
-# post(): send POST request to the API, return json
 # get_machine(): -m, get data about a machine and print it to console
+# get_machines(): -m with several machines, fetch them all at once
+# did_you_mean(): suggest machine names when one isn't found
+# read_names(): names/ids from the command line, or stdin for -
 # get_active(): -a, basically get_machine() but for currently active machine
 # get_writeup(): -w, get official writeup for a machine
+# mirror_writeups(): -w with several machines, download writeups in parallel
+# print_progress(): print download progress and speed
 # get_todo(): -t, get current to-do list
-# update_todo(): -T, add or remove a machine from your to-do list
+# list_machines(): --list, list machines from the local index
+# update_todo(): -T, add or remove machines from your to-do list
 # spawn_machine(): -S, spawn a machine
 # kill_machine(): -K, kill currently spawned machine
 # reset_machine(): -R, reset currently spawned machine
-# submit_flag(): -F, submit flag for currently spawned machine
+# submit_flag(): -F, submit flags for currently spawned machine
 # get_difficulty(): get user difficulty rating for submit_flag()
-# get_ip(): get IP of a machine
-# get_reviews(): return review data about a machine
 # print_json(): print a python dict prettily to console
+# print_records(): print dicts for --format (json, ndjson or a table)
+# machine_record(): the --format record for a machine
+# format_machine(): a machine's data in a human readable way
 # print_machine(): print a machine's data prettily to console
-
-# sends a get request to an endpoint in HTB's API, passing proper headers for auth
-# return json response as python dict
-def get(endpoint):
-    if not TOKEN:
-        print('no API token found in .env, you need one to make API requests')
-        print('instructions here: https://github.com/anton-3/htb-api')
-        sys.exit(1)
-    url = BASEURL + endpoint
-    response = requests.get(url, headers=HEADERS)
-    try:
-        return json.loads(response.content.decode('utf-8'))
-    # just return the regular response if it's not json
-    except (UnicodeDecodeError, json.decoder.JSONDecodeError):
-        return response
-
-# same but for post requests
-def post(endpoint, data=None):
-    if not TOKEN:
-        print('no API token found in .env, you need one to make API requests')
-        print('instructions here: https://github.com/anton-3/htb-api')
-        sys.exit(1)
-    url = BASEURL + endpoint
-    if data:
-        response = requests.post(url, headers=HEADERS, data=data)
-    else:
-        response = requests.post(url, headers=HEADERS)
-    try:
-        return json.loads(response.content.decode('utf-8'))
-    except (UnicodeDecodeError, json.decoder.JSONDecodeError):
-        return response
+# load_accounts(): --accounts, read the profile file
+# AccountOutput: stdout/stderr replacement that holds back each account's output
+# run_accounts(): --accounts, run a command for several accounts at once
+# DaemonOutput / DaemonInput: stdout/stdin replacements that go over the daemon's socket
+# run_daemon(): --daemon, serve commands over SOCKET_PATH
+# handle_daemon_command(): run one command for the daemon
+# send_to_daemon(): hand a command to a running daemon
+# completion_script(): --completion, the shell completion script
+# build_parser(): the command line arguments
+# run_command(): run the command from the parsed arguments
+# build_metrics() / print_trace() / write_metrics(): --trace and --metrics-json
+# main(): parse arguments and run the command
 
 # function for -m
-# GET /machine/profile/name_or_id OR /sp/machines/name_or_id
 # get data about a machine and print it to console
 # name_or_id is either the name or id of the machine
-# we can get the data directly if it's a lab machine (active or retired)
-# if it's a starting point machine, we need to make a second request
-def get_machine(name_or_id):
-    # if -m is passed without args, it's set to True by argparser
+# fmt is --format, anything but 'pretty' prints a record (see print_records())
+def get_machine(client, name_or_id, fmt='pretty'):
+    # if -m is passed without args, run_command() passes True
     # we want it to retrieve the currently spawned machine in that case
     if name_or_id == True:
-        active_response = get('/machine/active')
-        info = active_response['info']
+        info = client.get_active()
         if not info:
             print('no currently active machine')
             return
-        m_id = info['id']
         # /machine/active doesn't return very much info
-        # so we need to request /machine/profile with its newly acquired id
-        response = get(f'/machine/profile/{m_id}')
+        # so we need to get the full profile with its newly acquired id
+        name_or_id = info['id']
+    result = client.get_machine(name_or_id)
+    if not result:
+        print('error: no such machine' + did_you_mean(client, name_or_id), file=sys.stdout if fmt == 'pretty' else sys.stderr)
+        return
+    if fmt == 'pretty':
+        print_machine(*result)
     else:
-        # otherwise just make the same request with the arg
-        response = get('/machine/profile/' + name_or_id)
-    # if the request found a matching machine (either in active or retired)
-    if 'info' in response:
-        machine = response['info']
-        group = 'retired' if machine['retired'] == 1 else 'active'
-        print_machine(machine, group)
-    elif response['message'] == 'Starting Point Machine':
-        sp_machines = get('/sp/machines')['info']
-        # if this next() stuff throws a StopIteration then the API data is inaccurate (idc enough to handle that)
-        machine = next(machine for machine in sp_machines if name_or_id.lower() == machine['name'].lower() or name_or_id == str(machine['id']))
-        print_machine(machine, 'starting_point')
+        print_records([machine_record(*result)], fmt)
+
+# function for -m with more than one machine (or - to read them from stdin)
+# they all get fetched at once and printed in the order they were passed, in one go
+def get_machines(client, names, fmt='pretty'):
+    names = read_names(names)
+    text = []
+    records = []
+    for name_or_id, result in zip(names, client.get_machines(names)):
+        if not result:
+            if fmt == 'pretty':
+                text.append(f'error: no such machine {name_or_id}{did_you_mean(client, name_or_id)}\n')
+            else:
+                print(f'error: no such machine {name_or_id}{did_you_mean(client, name_or_id)}', file=sys.stderr)
+        elif fmt == 'pretty':
+            text.append(format_machine(*result))
+        else:
+            records.append(machine_record(*result))
+    if fmt == 'pretty':
+        sys.stdout.write(''.join(text))
+        sys.stdout.flush()
     else:
-        print('error: no such machine')
+        print_records(records, fmt)
+
+# what --format prints for a machine from get_machine(): the machine with its group and reviews added
+def machine_record(machine, group, reviews=None):
+    return dict(machine, group=group, reviews=reviews)
+
+# ', did you mean X?' for a machine that wasn't found, or '' if nothing in the completion index looks like it
+def did_you_mean(client, name_or_id):
+    suggestions = suggest_machine_names(name_or_id, cache_dir=client.list_cache_dir)
+    if not suggestions:
+        return ''
+    return ', did you mean ' + ' or '.join(suggestions) + '?'
+
+# ['-'] means the names are on stdin, separated by whitespace (one per line or all on one line)
+def read_names(names):
+    if names == ['-']:
+        return sys.stdin.read().split()
+    return names
 
 # function for -a
 # GET /machine/active
 # gets currently active machine and prints its information
-def get_active():
-    response = get('/machine/active')
-    info = response['info']
+# with --format, the record is /machine/active's info with the ip added
+def get_active(client, fmt='pretty'):
+    info = client.get_active()
     if not info:
-        print('no currently active machine')
+        print('no currently active machine', file=sys.stdout if fmt == 'pretty' else sys.stderr)
+        return
+    # /machine/active usually has the IP already, the lists are only a fallback
+    if fmt != 'pretty':
+        print_records([dict(info, ip=info.get('ip') or client.get_ip(info['id']))], fmt, ACTIVE_COLUMNS)
         return
     name = info['name']
     m_id = info['id']
@@ -170,59 +1676,120 @@ def get_active():
     print(f'      Expires in {expires_in_rounded}')
     print('      Getting IP: ')
     try:
-        # this call takes literal years so consider removing it
+        # /machine/active's own IP, or the machine list cache if it didn't send one
         # putting it in a try except so you can ctrl C it without stack trace output
-        print(f'      {get_ip(m_id)}')
-    except:
+        print(f'      {info.get("ip") or client.get_ip(m_id) or "unknown"}')
+    except KeyboardInterrupt:
         pass
 
 # function for -w
 # GET /machine/writeup/id
 # get official writeup for a machine
 # gets the currently active machine without an argument
-def get_writeup(name_or_id):
+def get_writeup(client, name_or_id):
     if name_or_id == True:
         # if no argument passed, get the ID of active machine
-        active_response = get('/machine/active')
-        info = active_response['info']
+        info = client.get_active()
         if not info:
             print('no currently active machine')
             return
-        m_id = info['id']
-        name = info['name']
     else:
-        # otherwise call /machine/profile to get both name and ID
+        # otherwise get both name and ID from the cached lists (or /machine/profile)
         # since we only have one of the two right now
-        profile_response = get('/machine/profile/' + name_or_id)
-        if 'info' in profile_response:
-            info = profile_response['info']
-            m_id = info['id']
-            name = info['name']
-        else:
-            print('error: no such machine')
+        info = client.find_cached_machine(name_or_id)
+        if not info:
+            profile_response = client.get('/machine/profile/' + name_or_id)
+            info = profile_response.get('info')
+        if not info:
+            print('error: no such machine' + did_you_mean(client, name_or_id))
             return
+    m_id = info['id']
+    name = info['name']
     # now we have the id for sure
-    print(f'requesting pdf writeup for {name}')
-    response = get(f'/machine/writeup/{m_id}')
-    if not response.status_code == 200:
-        print('error: no such machine')
-        return
     filename = f'{name}-writeup.pdf'
-    print(f'writing pdf data to {filename}')
-    with open(filename, 'wb') as f:
-        f.write(response.content)
+    print(f'requesting pdf writeup for {name}, saving it to {filename}')
+    result = client.download_writeup(m_id, filename, progress=print_progress)
+    if result:
+        # finish the progress line
+        print(file=sys.stderr)
+    if result is None:
+        print('error: no writeup for that machine')
+    elif result == 0:
+        print(f'{filename} is already up to date')
+    else:
+        print(f'saved {result / 1024 / 1024:.1f} MB to {filename}')
+
+# bulk mode for -w
+# downloads the writeups for a bunch of machines, pool_size at a time over the shared session
+# names is a list of machine names/ids, ['all'] for every retired machine or ['-'] to read them from stdin
+# writeups that are already in the current directory get skipped without a request
+def mirror_writeups(client, names):
+    import requests
+    if names == ['all']:
+        machines = list(client.get_machine_list('/machine/list/retired')['by_id'].values())
+        failures = []
+    else:
+        names = read_names(names)
+        machines = []
+        failures = []
+        # one look at each list instead of one per machine
+        client.load_machine_lists()
+        for name_or_id in names:
+            machine = client.find_listed_machine(name_or_id, retry=False)
+            if machine:
+                machines.append(machine)
+            else:
+                failures.append((name_or_id, 'no such machine'))
+
+    todo = [machine for machine in machines if not os.path.exists(f'{machine["name"]}-writeup.pdf')]
+    print(f'downloading {len(todo)} writeups ({len(machines) - len(todo)} already downloaded)')
+
+    # runs on a worker thread, returns the number of bytes downloaded
+    def download(machine):
+        filename = f'{machine["name"]}-writeup.pdf'
+        try:
+            result = client.download_writeup(machine['id'], filename)
+        # one failed download shouldn't kill the other ones
+        except (HTBError, OSError, requests.exceptions.RequestException) as e:
+            failures.append((machine['name'], str(e) or 'request failed'))
+            return 0
+        if result is None:
+            failures.append((machine['name'], 'no writeup'))
+            return 0
+        print(f'{filename} - {result / 1024 / 1024:.1f} MB')
+        return result
+
+    start = time.time()
+    downloaded = sum(client.concurrently(*(lambda machine=machine: download(machine) for machine in todo))) if todo else 0
+    elapsed = time.time() - start
+    speed = downloaded / elapsed / 1024 / 1024 if elapsed else 0
+    print(f'downloaded {downloaded / 1024 / 1024:.1f} MB in {elapsed:.1f}s ({speed:.1f} MB/s)')
+    if failures:
+        print(f'{len(failures)} failed:')
+        for name, reason in failures:
+            print(f'  {name} - {reason}')
+
+# prints a download progress line to stderr, overwriting the previous one
+def print_progress(done, total, downloaded, elapsed):
+    speed = downloaded / elapsed / 1024 / 1024 if elapsed else 0
+    total_str = f'/{total / 1024 / 1024:.1f}' if total else ''
+    print(f'\r{done / 1024 / 1024:.1f}{total_str} MB ({speed:.1f} MB/s)', end='', file=sys.stderr)
 
 # function for -t
 # GET /machine/todo
 # gets machines in your to-do list and prints them to the console
-def get_todo():
-    response = get('/machine/todo')
-    info = response['info']
+# with --format it's one record per machine, straight from the API
+def get_todo(client, fmt='pretty'):
+    info = client.get_todo()
+    if fmt != 'pretty':
+        print_records(info, fmt)
+        return
     print('https://app.hackthebox.com/machines/list/todo')
     if not info:
         print('no to-do machines found')
         return
 
+    lines = []
     for machine in info:
         m_name = machine['name']
         m_difficulty = machine['difficultyText']
@@ -231,158 +1798,162 @@ def get_todo():
         m_date_obj = datetime.strptime(machine['release'].split('T')[0], '%Y-%m-%d')
         m_days_ago = (datetime.now() - m_date_obj).days
         m_stars = machine['stars']
-        print(f'{m_name} - {m_difficulty} {m_os} - Diff Rating {m_difficulty_rating}/100 - {m_stars}/5 Stars - {m_days_ago} Days Old')
+        lines.append(f'{m_name} - {m_difficulty} {m_os} - Diff Rating {m_difficulty_rating}/100 - {m_stars}/5 Stars - {m_days_ago} Days Old')
+    print('\n'.join(lines))
+
+# function for --list
+# prints machines from the local index, filtered and sorted by --os, --difficulty, --unowned and --sort
+# group is 'all', 'active', 'retired' or 'starting_point'
+# it's a table unless --format says otherwise
+def list_machines(client, group, args):
+    machines = client.query_machines(None if group == 'all' else group, args.os, args.difficulty, args.unowned, args.sort)
+    if not machines and args.format in ('pretty', 'table'):
+        print('no machines found')
+        return
+    print_records(machines, 'table' if args.format == 'pretty' else args.format)
 
 # function for -T
 # POST /machine/todo/update/id
-# adds or removes a machine from your to-do list
-def update_todo(name_or_id):
-    # we need the id to spawn the machine
-    if name_or_id.isnumeric():
-        # if name_or_id is an id, we can just use it in the spawn request
-        m_id = int(name_or_id)
-    else:
-        # if it's a name, we need to send a request and get the id
-        name = name_or_id
-        info_response = get('/machine/profile/' + name)
-        if 'info' in info_response:
-            m_id = info_response['info']['id']
-        else:
-            print('error: no such machine')
-            return
-
-    print(f'updating to-do for machine ID {m_id}...')
-    # get the todo list before updating so we can check if the machine got added or removed
-    before_todo = get('/machine/todo')
-    todo_response = post(f'/machine/todo/update/{m_id}')
-
-    # if it found the machine
-    if 'info' in todo_response:
-        # todo_response['info'] is the to-do list after the update
-        old_todo_size = len(before_todo['info'])
-        new_todo_size = len(todo_response['info'])
-
-        # if new list is bigger than old list, it got added
-        if new_todo_size > old_todo_size:
+# adds or removes machines from your to-do list, names is a list (['-'] reads them from stdin)
+# with --format there's a {'machine', 'result'} record for each machine, result is 'added', 'removed' or None
+def update_todo(client, names, fmt='pretty'):
+    names = read_names(names)
+    if fmt != 'pretty':
+        results = client.update_todos(names)
+        print_records([{'machine': name_or_id, 'result': result} for name_or_id, result in zip(names, results)], fmt, TODO_COLUMNS)
+        return
+    if len(names) == 1:
+        print(f'updating to-do for machine {names[0]}...')
+        result = client.update_todo(names[0])
+        if result == 'added':
             print('added machine to to-do list')
-        # if vice versa, it got removed
-        elif new_todo_size < old_todo_size:
+        elif result == 'removed':
             print('removed machine from to-do list')
-        # this should never happen but I'll handle it anyway
+        # if it didn't find the machine
         else:
-            print('something happened, idk what')
-
-    # if it didn't find the machine
-    else:
-        print('error: no such machine')
+            print('error: no such machine' + did_you_mean(client, names[0]))
+        return
+    print(f'updating to-do for {len(names)} machines...')
+    results = client.update_todos(names)
+    print('\n'.join(f'{name_or_id} - {result or "error: no such machine"}' for name_or_id, result in zip(names, results)))
 
 # function for -S
 # POST /vm/spawn {'machine_id': 123}
 # spawns an instance of a machine given name or id
-def spawn_machine(name_or_id):
+# wait=True (--wait) polls until it's deployed, probe=True (--probe) also waits until its IP answers
+def spawn_machine(client, name_or_id, wait=False, probe=False):
     # we need the id to spawn the machine
-    if name_or_id.isnumeric():
-        # if name_or_id is an id, we can just use it in the spawn request
-        m_id = int(name_or_id)
-    else:
-        # if it's a name, we need to send a request and get the id
-        name = name_or_id
-        info_response = get('/machine/profile/' + name)
-        if 'info' in info_response:
-            m_id = info_response['info']['id']
-        else:
-            print('error: no such machine')
-            return
+    # names get looked up in the cached machine lists
+    m_id = client.resolve_id(name_or_id)
+    if not m_id:
+        print('error: no such machine' + did_you_mean(client, name_or_id))
+        return
 
     # try to spawn the machine from the ID
     print(f'spawning machine ID {m_id}... (may take a while)')
-    data = {'machine_id': m_id}
-    spawn_response = post('/vm/spawn', data)
-    message = spawn_response['message']
+    start = time.perf_counter()
+    message = client.spawn_machine(m_id)
+    spawn_time = time.perf_counter() - start
+    if message != 'Machine deployed to lab.':
+        print(message)
+        return
 
-    # if it worked, tell the user the IP of the machine as well
-    if message == 'Machine deployed to lab.':
-        m_ip = get_ip(m_id)
-        m_url = f'https://app.hackthebox.com/machines/{m_id}'
-        message += f'\n{m_url}\n{m_ip}'
+    # with --wait, don't say anything else until the machine is actually up (and answering with --probe)
+    if wait or probe:
+        print(message)
+        print('waiting for it to come up...')
+        info, polls = client.wait_for_machine(m_id)
+        if not info:
+            print(f'error: machine still isn\'t up after {SPAWN_TIMEOUT // 60} minutes')
+            return
+        deploy_time = time.perf_counter() - start - spawn_time
+        # /machine/active doesn't always have the IP, the machine lists do for lab machines
+        m_ip = info.get('ip') or client.get_ip(m_id)
+        timings = f'spawn {spawn_time:.1f}s, deploy {deploy_time:.1f}s over {polls} polls'
+        if probe:
+            # without an IP there's nothing to probe (and probing None would just hit localhost)
+            if not m_ip:
+                print(f'error: couldn\'t get the IP of machine ID {m_id} to probe it')
+                return
+            if not client.wait_until_reachable(m_ip):
+                print(f'error: {m_ip} isn\'t answering, is the VPN connected?')
+                return
+            timings += f', reachable {time.perf_counter() - start - spawn_time - deploy_time:.1f}s'
+        print(f'https://app.hackthebox.com/machines/{m_id}\n{m_ip}')
+        print(f'ready in {time.perf_counter() - start:.1f}s ({timings})')
+        return
 
+    # if it worked, tell the user the IP of the machine as well
+    m_ip = client.get_ip(m_id)
+    m_url = f'https://app.hackthebox.com/machines/{m_id}'
+    message += f'\n{m_url}\n{m_ip}'
     print(message)
 
 # function for -K
 # POST /vm/terminate {'machine_id': 123}
 # kills the currently spawned machine instance
-def kill_machine():
+def kill_machine(client):
     # get the currently active machine first
     # since for some reason we need to pass the ID of the machine we're killing
-    active_response = get('/machine/active')
-    info = active_response['info']
+    # (straight from HTB, a cached answer could be a machine that got switched out since)
+    info = client.get_active(force=True)
     if not info:
         print('no currently active machine')
         return
     name = info['name']
     m_id = info['id']
     print(f'killing {name}...')
-    data = {'machine_id': m_id}
-    kill_response = post('/vm/terminate', data)
-    message = kill_response['message']
-    print(message)
+    print(client.kill_machine(m_id))
 
 # function for -R
 # POST /vm/reset {'machine_id': 123}
 # requests a reset for the current active machine instance
-def reset_machine():
-    active_response = get('/machine/active')
-    info = active_response['info']
+def reset_machine(client):
+    # not the cached active machine, same as -K
+    info = client.get_active(force=True)
     if not info:
         print('no currently active machine')
         return
     name = info['name']
     m_id = info['id']
     print(f'requesting reset for {name}...')
-    data = {'machine_id': m_id}
-    reset_response = post('/vm/reset', data)
-    message = reset_response['message']
-    print(message)
+    print(client.reset_machine(m_id))
 
 # function for -F
 # POST /machine/own {'flag': flag, 'id': 123, 'difficulty': 5}
-# submits a flag for the currently active machine
-# prompts for difficulty rating, user must input an integer between 1 and 10 inclusive
-# flag_arg is either the flag text itself e.g. "e0d0a3d75aae2526566b0892d28de23c"
+# submits flags for the currently active machine, in the order they're passed
+# prompts for difficulty rating once, user must input an integer between 1 and 10 inclusive
+# each of flag_args is either the flag text itself e.g. "e0d0a3d75aae2526566b0892d28de23c"
 # or a path to a flag file like user.txt or root.txt
-def submit_flag(flag_arg):
+def submit_flag(client, flag_args):
     # first, make sure a machine is spawned, if so get its ID
-    # i'm violating DRY here I know
-    active_response = get('/machine/active')
-    info = active_response['info']
+    # straight from HTB so a flag never goes to a machine that was switched in the meantime
+    info = client.get_active(force=True)
     if not info:
         print('no currently active machine')
         return
     name = info['name']
     m_id = info['id']
     flag_chars = '0123456789abcdef'
-    if all(char in flag_chars for char in flag_arg):
-        # if flag_args is exclusively in hex characters, treat it as the flag itself
-        flag = flag_arg
-    else:
+    flags = []
+    for flag_arg in flag_args:
+        if all(char in flag_chars for char in flag_arg):
+            # if flag_arg is exclusively in hex characters, treat it as the flag itself
+            flags.append(flag_arg)
+            continue
         # otherwise read from that file
         try:
             with open(flag_arg, 'r') as f:
-                flag = f.read().strip() # strip the newline at the end
+                flags.append(f.read().strip()) # strip the newline at the end
         except FileNotFoundError:
-            print('error: invalid flag format or couldn\'t read flag file')
+            print(f'error: invalid flag format or couldn\'t read flag file {flag_arg}')
             return
-    # get the difficulty rating from the user
+    # get the difficulty rating from the user, once for all the flags
     difficulty = get_difficulty()
-    print(f'submitting flag {flag} with difficulty {difficulty}/10 for machine {name}')
-    data = {}
-    data['flag'] = flag
-    data['id'] = m_id
-    data['difficulty'] = difficulty * 10 # the actual endpoint expects 10-100
-    submit_response = post('/machine/own', data)
-    message = submit_response['message']
-    status = submit_response['status']
-    print(f'{status} {message}')
+    for flag in flags:
+        print(f'submitting flag {flag} with difficulty {difficulty}/10 for machine {name}')
+    for status, message in client.submit_flags(m_id, flags, difficulty):
+        print(f'{status} {message}')
 
 # gets a difficulty rating from the user for submit_flag
 # must be an integer between 1 and 10 inclusive
@@ -393,39 +1964,41 @@ def get_difficulty():
             return int(difficulty)
         print('error: invalid input, must be an integer between 1 to 10 inclusive')
 
-# gets IP of machine given its name or ID
-# in general should avoid this as it takes several seconds to run
-# for some godforsaken reason the only way I know of to get a machine's IP
-# is to query for literally every machine and select for the correct IP
-# only works for lab machines (either active or retired)
-def get_ip(name_or_id):
-    # first make a request to /machine/profile/{name_or_id} to get the group that it's in
-    info_response = get(f'/machine/profile/{name_or_id}')
-    if not 'info' in info_response:
-        print('get_ip() error, this shouldn\'t have happened')
-        return
-    info = info_response['info']
-    m_id = info['id']
-    endpoint = '/machine/list/retired' if info['retired'] == 1 else '/machine/list'
-    list_response = get(endpoint)
-    list_info = list_response['info']
-    machine = next(machine for machine in list_info if m_id == machine['id'])
-    return machine['ip']
-
-# get and return review data for a machine given its id
-# this is only used for one part of the output in print_machine()
-def get_reviews(machine_id):
-    review_data = get('/machine/reviews/' + str(machine_id))['message']
-    return review_data
-
 # print json data (python dict) to the console prettily
 def print_json(data):
     print(json.dumps(data, indent=4))
 
-# take json data about a machine and print it in a human readable way
+# prints a list of dicts for --format, all in one write so big listings don't crawl through a pipe
+# json is one array, ndjson is one object per line and table lines up columns ((header, value) pairs) under a header
+def print_records(records, fmt, columns=MACHINE_COLUMNS):
+    # with --accounts every record says whose it is, and json and table records get handed to run_accounts()
+    # so every account ends up in the same array or table
+    account = getattr(ACCOUNT, 'name', None)
+    if account is not None:
+        records = [dict(record, account=account) for record in records]
+        columns = [('account', lambda record: record['account'])] + columns
+        if fmt in ('json', 'table'):
+            ACCOUNT.records.extend(records)
+            ACCOUNT.columns = columns
+            return
+    if fmt == 'json':
+        text = json.dumps(records, indent=4) + '\n'
+    elif fmt == 'ndjson':
+        text = ''.join(json.dumps(record) + '\n' for record in records)
+    else:
+        rows = [[header for header, _ in columns]]
+        rows += [['' if value is None else str(value) for value in (get(record) for _, get in columns)] for record in records]
+        widths = [max(len(row[index]) for row in rows) for index in range(len(columns))]
+        text = ''.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() + '\n' for row in rows)
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+# take json data about a machine and turn it into text that's human readable, print_machine() prints it
 # group is 'active', 'retired', or 'starting_point'
 # need to know the group bc different groups return different data about their machines
-def print_machine(machine, group):
+# reviews is the list from get_reviews(), None if we don't have access to them
+def format_machine(machine, group, reviews=None):
+    lines = []
     # do starting point first bc it's different
     if group == 'starting_point':
         m_name = machine['name']
@@ -437,17 +2010,14 @@ def print_machine(machine, group):
         m_days_ago = (datetime.now() - m_date_obj).days
         m_user_owns = machine['user_owns_count']
         m_root_owns = machine['root_owns_count']
-        print(f'\n      {m_name} - {m_difficulty} {m_os} - Starting Point - by {m_author}')
-        print(f'      Released {m_date_str} ({m_days_ago} days ago)')
-        print(f'      {m_user_owns} User Owns, {m_root_owns} Root Owns\n')
-        return
+        lines.append(f'\n      {m_name} - {m_difficulty} {m_os} - Starting Point - by {m_author}')
+        lines.append(f'      Released {m_date_str} ({m_days_ago} days ago)')
+        lines.append(f'      {m_user_owns} User Owns, {m_root_owns} Root Owns\n')
+        return '\n'.join(lines) + '\n'
 
     # active and retired have a lot more data to display
     # review data is only accessible sometimes
-    reviews = get_reviews(machine['id'])
-    # store whether or not we have access to review data that we should print later
-    # if it's a str it'll be 'You do not have access to the reviews'
-    show_reviews = type(reviews) != str
+    show_reviews = reviews is not None
 
     # get all the values from the machine dict
     m_name = machine['name']
@@ -469,47 +2039,497 @@ def print_machine(machine, group):
         m_review_count = len(reviews)
         m_has_author_review = bool([review for review in reviews if review['user']['name'] == m_author])
 
-    # print everything
-    print(f'\n      {m_name} - {m_difficulty} {m_os} - {group.capitalize()} - by {m_author}')
-    print(f'      {m_url}')
-    print(f'      Released {m_date_str} ({m_days_ago} days ago)')
-    print(f'      User Difficulty Rating {m_difficulty_rating}/100')
-    print(f'      {m_user_owns} User Owns, {m_root_owns} Root Owns')
-    print(f'\n      Rating - {m_stars}/5 Stars' + (f' - {m_review_count} Reviews' if show_reviews else ' - No Reviews'))
-    print(f'         {int(float(m_stars) * 10) * "#"}{(50 - int(float(m_stars) * 10)) * "-"}')
+    # put everything together
+    lines.append(f'\n      {m_name} - {m_difficulty} {m_os} - {group.capitalize()} - by {m_author}')
+    lines.append(f'      {m_url}')
+    lines.append(f'      Released {m_date_str} ({m_days_ago} days ago)')
+    lines.append(f'      User Difficulty Rating {m_difficulty_rating}/100')
+    lines.append(f'      {m_user_owns} User Owns, {m_root_owns} Root Owns')
+    lines.append(f'\n      Rating - {m_stars}/5 Stars' + (f' - {m_review_count} Reviews' if show_reviews else ' - No Reviews'))
+    lines.append(f'         {int(float(m_stars) * 10) * "#"}{(50 - int(float(m_stars) * 10)) * "-"}')
     if show_reviews and m_has_author_review:
-        print('      including a self review by the author (cringe)')
-    print('\n      Difficulty Ratings:')
+        lines.append('      including a self review by the author (cringe)')
+    lines.append('\n      Difficulty Ratings:')
     max_count = max(feedback.values())
     counter = 1
     for index, d in enumerate(difficulty):
         vote_count = feedback[d]
         num = int(vote_count / max_count * 50)
-        print(f"      {index+1}{'' if len(str(index+1)) == 2 else ' '} {num * '#'}{(50 - num) * '-'} {vote_count}")
-    print()
+        lines.append(f"      {index+1}{'' if len(str(index+1)) == 2 else ' '} {num * '#'}{(50 - num) * '-'} {vote_count}")
+    lines.append('')
+    return '\n'.join(lines) + '\n'
+
+def print_machine(machine, group, reviews=None):
+    sys.stdout.write(format_machine(machine, group, reviews))
+    sys.stdout.flush()
+
+# multi-account mode (--accounts)
+# the command runs for every account at the same time, each on its own thread with its own HTBClient
+# ACCOUNT is the account the current thread is running for, with its held back output, see AccountOutput
+ACCOUNT = threading.local()
+
+# reads the profile file, returns {name: token} for every account in it, or just the ones in names (in that order)
+# raises HTBError if the file or one of the names is missing
+def load_accounts(filename, names):
+    from dotenv import dotenv_values
+    if not os.path.exists(filename):
+        raise HTBError(f'error: no accounts file at {filename}')
+    accounts = {name: token for name, token in dotenv_values(filename).items() if token}
+    missing = [name for name in names if name not in accounts]
+    if missing:
+        raise HTBError(f'error: no account {", ".join(missing)} in {filename}')
+    if names:
+        return {name: accounts[name] for name in names}
+    if not accounts:
+        raise HTBError(f'error: no accounts in {filename}')
+    return accounts
+
+# file-like object run_accounts() swaps in for sys.stdout/sys.stderr
+# threads running for an account write into that account's buffer, anything else goes straight to stream
+class AccountOutput:
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+
+    def write(self, text):
+        buffer = getattr(ACCOUNT, self.name, None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(ACCOUNT, self.name, None) is None:
+            self.stream.flush()
+
+# function for --accounts
+# runs the command from args for every account in accounts ({name: token}) at the same time
+# settings are the HTBClient arguments from .env, every client gets its own cache dir and they all share the lists
+# each account's output is printed in order once they're all done, under its name for pretty output
+# returns the highest exit code
+def run_accounts(accounts, args, parser, settings):
+    from concurrent.futures import ThreadPoolExecutor
+    # stdin can only be read once, not once per account
+    if args.m == ['-']:
+        args.m = sys.stdin.read().split()
+    if args.T == ['-']:
+        args.T = sys.stdin.read().split()
+    machine_lists = {}
+    clients = {name: HTBClient(token, cache_dir=os.path.join(CACHE_DIR, 'accounts', name), list_cache_dir=os.path.join(CACHE_DIR, 'shared'),
+                               machine_lists=machine_lists, **settings)
+               for name, token in accounts.items()}
+    try:
+        # everything but -t looks machines up in the lists, load them once here instead of once per account
+        if not args.t:
+            try:
+                next(iter(clients.values())).load_machine_lists()
+            except HTBError as e:
+                print(e)
+                return 1
+
+        def run(name):
+            ACCOUNT.name = name
+            ACCOUNT.out, ACCOUNT.err, ACCOUNT.records, ACCOUNT.columns = [], [], [], None
+            try:
+                return run_command(clients[name], args, parser), ACCOUNT.out, ACCOUNT.err, ACCOUNT.records, ACCOUNT.columns
+            finally:
+                ACCOUNT.__dict__.clear()
+
+        old_streams = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = AccountOutput(sys.stdout, 'out'), AccountOutput(sys.stderr, 'err')
+        try:
+            with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+                results = list(executor.map(run, clients))
+        finally:
+            sys.stdout, sys.stderr = old_streams
+    finally:
+        for client in clients.values():
+            client.close()
+
+    records = []
+    columns = None
+    for index, (name, (exit_code, out, err, account_records, account_columns)) in enumerate(zip(clients, results)):
+        if args.format == 'pretty':
+            print(('\n' if index else '') + f'== {name} ==')
+        sys.stdout.write(''.join(out))
+        sys.stdout.flush()
+        sys.stderr.write(''.join(err))
+        records += account_records
+        columns = columns or account_columns
+    if columns:
+        print_records(records, args.format, columns)
+    return max(exit_code for exit_code, *_ in results)
+
+# daemon mode (--daemon)
+# one long running process holds the client, so the session, machine lists and active machine stay warm
+# the script connects to SOCKET_PATH, sends {'argv': [...], 'cwd': '...'} and the daemon runs the command
+# while the command runs the daemon's stdout/stderr/stdin go over the socket as json lines:
+# {'out': text}, {'err': text}, {'input': 'line' or 'all'} (answered with {'input': text}) and finally {'exit': code}
+
+# file-like object the daemon swaps in for sys.stdout/sys.stderr
+class DaemonOutput:
+    def __init__(self, conn, stream, lock):
+        self.conn = conn
+        self.stream = stream
+        self.lock = lock
+
+    def write(self, text):
+        if text:
+            with self.lock:
+                self.conn.write(json.dumps({self.stream: text}) + '\n')
+                self.conn.flush()
+        return len(text)
+
+    def flush(self):
+        pass
+
+# file-like object the daemon swaps in for sys.stdin, asks the script for input when it's read
+class DaemonInput:
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def ask(self, what):
+        with self.lock:
+            self.conn.write(json.dumps({'input': what}) + '\n')
+            self.conn.flush()
+        return json.loads(self.conn.readline())['input']
+
+    def readline(self):
+        return self.ask('line')
+
+    def read(self, size=-1):
+        return self.ask('all')
+
+# runs the daemon until it gets killed
+# commands run one at a time since they swap out sys.stdout and the working directory
+# settings are the HTBClient arguments client was made with, for the background refresh's own client
+def run_daemon(client, parser, settings):
+    # keep the active machine and machine lists fresh so commands don't have to wait for them
+    # the refresh gets its own client so it doesn't show up in a command's memo, spans or --stats,
+    # it shares the list indexes and hands the active machine over
+    # (unless a command spawned, killed or reset something while it was asking, then its answer is already old)
+    refresher = HTBClient(client.token, cache_dir=client.cache_dir, machine_lists=client.machine_lists, **settings)
+    def refresh():
+        while True:
+            try:
+                generation = client.active_generation
+                client.save_active_from(generation, refresher.get('/machine/active', memo=False)['info'])
+                for endpoint in LIST_TTLS:
+                    refresher.get_machine_list(endpoint)
+            # nothing the refresh runs into should take the daemon's refreshing down with it
+            except Exception:
+                pass
+            refresher.spans = []
+            time.sleep(DAEMON_REFRESH)
+    threading.Thread(target=refresh, daemon=True).start()
+
+    os.makedirs(os.path.dirname(SOCKET_PATH), exist_ok=True)
+    if os.path.exists(SOCKET_PATH):
+        os.remove(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the daemon has your API token, so only you get to talk to it
+    old_umask = os.umask(0o177)
+    try:
+        server.bind(SOCKET_PATH)
+    finally:
+        os.umask(old_umask)
+    server.listen()
+    print(f'htb daemon listening on {SOCKET_PATH}')
+    try:
+        while True:
+            sock, _ = server.accept()
+            with sock, sock.makefile('rw') as conn:
+                try:
+                    handle_daemon_command(client, parser, conn)
+                # the script went away mid command (or sent garbage), nothing to tell it
+                # whatever goes wrong with one connection, the daemon keeps serving the next ones
+                except Exception:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(SOCKET_PATH)
+
+# runs one command sent to the daemon with its output going back over conn
+def handle_daemon_command(client, parser, conn):
+    request = json.loads(conn.readline())
+    lock = threading.Lock()
+    old_streams = sys.stdout, sys.stderr, sys.stdin
+    old_cwd = os.getcwd()
+    sys.stdout = DaemonOutput(conn, 'out', lock)
+    sys.stderr = DaemonOutput(conn, 'err', lock)
+    sys.stdin = DaemonInput(conn, lock)
+    try:
+        # -w and -F use paths relative to wherever the script was run
+        os.chdir(request['cwd'])
+        args = parser.parse_args(request['argv'])
+        if args.refresh:
+            client.machine_lists.clear()
+            client.refresh = True
+        exit_code = run_command(client, args, parser)
+    # argparse errors exit
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 0
+    # a bug in one command shouldn't kill the daemon, the script gets the traceback instead
+    except Exception:
+        import traceback
+        sys.stderr.write(traceback.format_exc())
+        exit_code = 1
+    finally:
+        client.refresh = False
+        os.chdir(old_cwd)
+        sys.stdout, sys.stderr, sys.stdin = old_streams
+    conn.write(json.dumps({'exit': exit_code}) + '\n')
+    conn.flush()
+
+# sends a command to the daemon and relays its output
+# returns the exit code, or None if there's no daemon running
+def send_to_daemon(argv):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(SOCKET_PATH)
+    except OSError:
+        sock.close()
+        return None
+    with sock, sock.makefile('rw') as conn:
+        conn.write(json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n')
+        conn.flush()
+        for line in conn:
+            message = json.loads(line)
+            if 'out' in message:
+                sys.stdout.write(message['out'])
+                sys.stdout.flush()
+            elif 'err' in message:
+                sys.stderr.write(message['err'])
+                sys.stderr.flush()
+            elif 'input' in message:
+                text = sys.stdin.read() if message['input'] == 'all' else sys.stdin.readline()
+                conn.write(json.dumps({'input': text}) + '\n')
+                conn.flush()
+            elif 'exit' in message:
+                return message['exit']
+    # daemon died mid command
+    return 1
+
+# function for --completion
+# the script for shell (bash, zsh or fish), completing options and machine names for the command it was run as
+# eval "$(./htb.py --completion bash)" in .bashrc
+def completion_script(shell, parser):
+    options = [option for action in parser._actions if action.help != SUPPRESS for option in action.option_strings]
+    if shell == 'fish':
+        # fish wants each option as its own complete command
+        options = '\n'.join(f'complete -c {parser.prog} ' + (f'-l {option[2:]}' if option.startswith('--') else f'-s {option[1:]}') for option in options)
+    else:
+        options = ' '.join(options)
+    return COMPLETION_SCRIPTS[shell].replace('@PROG@', parser.prog).replace('@OPTIONS@', options)
+
+# parse command line arguments
+def build_parser():
+    parser = ArgumentParser(formatter_class=RawDescriptionHelpFormatter, description='simple commands to call the HackTheBox v4 API\nall commands are mutually exclusive')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-m', type=str, metavar='machine', help='print info about machines (default: active) - - reads them from stdin', nargs='*')
+    group.add_argument('-a', action='store_true', help='show currently active (spawned) machine')
+    group.add_argument('-w', type=str, metavar='machine', help='get official pdf writeup for machines (default: active) and save them to files - \'all\' for every retired one', nargs='*')
+    group.add_argument('-t', action='store_true', help='print current to-do list')
+    group.add_argument('-T', type=str, metavar='machine', help='add or remove machines from your to-do list - - reads them from stdin', nargs='+')
+    group.add_argument('-S', type=str, metavar='machine', help='spawn an instance of a machine')
+    group.add_argument('-K', action='store_true', help='kill the currently active machine')
+    group.add_argument('-R', action='store_true', help='request a reset for the currently active machine')
+    group.add_argument('-F', type=str, metavar='flag', help='submit flags for the currently active machine - either flag text or filenames', nargs='+')
+    parser.add_argument('--wait', action='store_true', help='wait until the spawned machine is up before printing its IP (-S)')
+    parser.add_argument('--probe', action='store_true', help='like --wait, but also wait until the machine answers on the network (-S)')
+    parser.add_argument('--format', type=str, default='pretty', choices=['pretty', 'table', 'json', 'ndjson'], metavar='format',
+                        help='output for -m, -a, -t, -T and --list - pretty, table, json or ndjson (default: pretty)')
+    parser.add_argument('--refresh', action='store_true', help='ignore the local machine list cache and redownload it')
+    parser.add_argument('--stats', action='store_true', help='print how many connections were opened and reused after the command')
+    parser.add_argument('--trace', action='store_true', help='print timings for every request and cache lookup after the command')
+    parser.add_argument('--metrics-json', type=str, metavar='file', help='write request timings and totals as json to a file (- for stdout)')
+    group.add_argument('--list', type=str, metavar='group', help='list machines from the local index (default: all) - active, retired, starting_point or all',
+                       nargs='?', const='all', choices=['all', 'active', 'retired', 'starting_point'])
+    parser.add_argument('--os', type=str, metavar='os', help='only list machines with this os (--list)')
+    parser.add_argument('--difficulty', type=str, metavar='difficulty', help='only list machines with this difficulty, like easy or "very easy" (--list)')
+    parser.add_argument('--unowned', action='store_true', help='only list machines you don\'t have root on (--list)')
+    parser.add_argument('--sort', type=str, default='name', choices=MACHINE_SORTS, metavar='field', help='what to sort --list by - name, stars, release, difficulty or owns (default: name)')
+    group.add_argument('--daemon', action='store_true', help='run in the background keeping the session and caches warm, other commands go through it')
+    parser.add_argument('--no-daemon', action='store_true', help='don\'t send the command to a running daemon')
+    parser.add_argument('--accounts', type=str, metavar='account', nargs='*',
+                        help='run -m, -a, -t or -T for every account in the accounts file (or just the ones named) at the same time')
+    group.add_argument('--completion', type=str, metavar='shell', choices=['bash', 'zsh', 'fish'],
+                       help='print a completion script for bash, zsh or fish - eval "$(./htb.py --completion bash)"')
+    # what the completion scripts call to get machine names
+    parser.add_argument('--complete', type=str, metavar='prefix', help=SUPPRESS)
+    if ENABLE_DEBUGGING:
+        group.add_argument('-d', action='store_true', help='debug mode')
+    return parser
+
+# runs the command from parsed args with the given client, returns the exit code
+# used by main() and by the daemon for every command it gets sent
+def run_command(client, args, parser):
+    exit_code = 0
+    client.spans = []
+    client.bytes_saved = 0
+    # GETs are deduplicated for the length of one command, see HTBClient.get_body()
+    client.memo = {}
+    # the session's counters go back to when it was made, which for the daemon is a lot of commands ago
+    requests_before, connections_before = client.connection_stats()
+    start = time.perf_counter()
+    try:
+        if args.m is not None:
+            # -m with no args is the active machine, more than one machine (or -) fetches them all at once
+            if len(args.m) > 1 or args.m == ['-']:
+                get_machines(client, args.m, args.format)
+            else:
+                get_machine(client, args.m[0] if args.m else True, args.format)
+        elif args.a:
+            get_active(client, args.format)
+        elif args.w is not None:
+            # -w with no args is the active machine, more than one machine is bulk mode
+            if len(args.w) > 1 or args.w in (['all'], ['-']):
+                mirror_writeups(client, args.w)
+            else:
+                get_writeup(client, args.w[0] if args.w else True)
+        elif args.t:
+            get_todo(client, args.format)
+        elif args.T:
+            update_todo(client, args.T, args.format)
+        elif args.S:
+            spawn_machine(client, args.S, args.wait, args.probe)
+        elif args.K:
+            kill_machine(client)
+        elif args.R:
+            reset_machine(client)
+        elif args.F:
+            submit_flag(client, args.F)
+        elif args.list:
+            list_machines(client, args.list, args)
+        elif ENABLE_DEBUGGING and args.d:
+            from IPython import embed
+            embed()
+        elif args.refresh:
+            # --refresh on its own just redownloads the cached lists (and updates the machine index with them)
+            for endpoint in LIST_TTLS:
+                index = client.get_machine_list(endpoint, force=True)
+                print(f'cached {len(index["by_id"])} machines from {endpoint}')
+            client.sync_machine_db()
+        else:
+            parser.print_help()
+    except HTBError as e:
+        print(e)
+        exit_code = 1
+    finally:
+        client.memo = None
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    if args.stats:
+        total_requests, total_connections = client.connection_stats()
+        total_requests -= requests_before
+        total_connections -= connections_before
+        print(f'{total_requests} requests, {total_connections} handshakes, {total_requests - total_connections} reused connections, {client.bytes_saved} bytes saved by the cache', file=sys.stderr)
+    if args.trace or args.metrics_json:
+        # the command is whichever flag got passed
+        command = next((('-' if len(flag) == 1 else '--') + flag for flag in ('m', 'a', 'w', 't', 'T', 'S', 'K', 'R', 'F', 'list')
+                        if getattr(args, flag) not in (None, False)), None)
+        metrics = build_metrics(command, exit_code, wall_ms, client.spans, client.bytes_saved)
+        if args.trace:
+            print_trace(metrics)
+        if args.metrics_json:
+            write_metrics(metrics, args.metrics_json)
+    return exit_code
+
+# sums up the spans from a command for --trace and --metrics-json
+def build_metrics(command, exit_code, wall_ms, spans, bytes_saved):
+    requests_sent = [span for span in spans if span['type'] == 'request']
+    lookups = [span for span in spans if span['type'] == 'cache']
+    return {
+            'command': command,
+            'exit_code': exit_code,
+            'wall_ms': round(wall_ms, 2),
+            'requests': len(requests_sent),
+            'new_connections': sum(span['new_connection'] for span in requests_sent),
+            'bytes': sum(span.get('bytes', 0) for span in requests_sent),
+            'request_ms': round(sum(span.get('total_ms', 0) for span in requests_sent), 2),
+            'cache_hits': sum(span['cache'] == 'hit' for span in lookups),
+            'cache_misses': sum(span['cache'] == 'miss' for span in lookups),
+            'bytes_saved': bytes_saved,
+            'spans': spans
+            }
+
+# --trace, prints every request and cache lookup and then the totals to stderr
+def print_trace(metrics):
+    for span in metrics['spans']:
+        if span['type'] == 'cache':
+            where = f' ({span["where"]})' if 'where' in span else ''
+            print(f'cache {span["cache"]} {span["endpoint"]}{where}', file=sys.stderr)
+            continue
+        timings = ' '.join(f'{name} {span[name + "_ms"]}' for name in ('dns', 'connect', 'tls', 'ttfb', 'total') if name + '_ms' in span)
+        result = span.get('status', span.get('error'))
+        retry = f' (attempt {span["attempt"]})' if span['attempt'] > 1 else ''
+        print(f'{span["method"]} {span["endpoint"]}{retry} {result} - {timings} ms - {span.get("bytes", 0)} bytes', file=sys.stderr)
+    print(f'{metrics["command"]}: {metrics["wall_ms"]:.0f} ms, {metrics["requests"]} requests ({metrics["new_connections"]} new connections), '
+          f'{metrics["bytes"]} bytes ({metrics["bytes_saved"]} saved by the cache), {metrics["cache_hits"]} cache hits, {metrics["cache_misses"]} cache misses', file=sys.stderr)
+
+# --metrics-json, writes the metrics to a file ('-' for stdout)
+def write_metrics(metrics, filename):
+    if filename == '-':
+        print(json.dumps(metrics))
+        return
+    with open(filename, 'w') as f:
+        json.dump(metrics, f)
 
 def main():
-    if args.m:
-        get_machine(args.m)
-    elif args.a:
-        get_active()
-    elif args.w:
-        get_writeup(args.w)
-    elif args.t:
-        get_todo()
-    elif args.T:
-        update_todo(args.T)
-    elif args.S:
-        spawn_machine(args.S)
-    elif args.K:
-        kill_machine()
-    elif args.R:
-        reset_machine()
-    elif args.F:
-        submit_flag(args.F)
-    elif ENABLE_DEBUGGING and args.d:
-        embed()
+    parser = build_parser()
+    args = parser.parse_args()
+
+    # completion runs on every tab press, so it doesn't go through the daemon or load anything
+    if args.complete is not None:
+        names = complete_machine_names(args.complete)
+        if names:
+            print('\n'.join(names))
+        return
+    if args.completion:
+        print(completion_script(args.completion, parser), end='')
+        return
+
+    if args.accounts is not None and args.m is None and not (args.a or args.t or args.T):
+        parser.error('--accounts works with -m, -a, -t and -T')
+
+    # if a daemon is running, let it do the work with its warm session and caches
+    # (it only has the one account though)
+    if not args.daemon and not args.no_daemon and args.accounts is None:
+        exit_code = send_to_daemon(sys.argv[1:])
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    # get API token and connection settings from .env
+    # pool size and timeouts (in seconds) can be overridden there
+    # (only now, so -h and commands the daemon runs never load dotenv)
+    from dotenv import load_dotenv
+    load_dotenv()
+    settings = dict(
+            pool_size=int(os.getenv('POOL_SIZE', 4)),
+            timeout=(float(os.getenv('CONNECT_TIMEOUT', 5)), float(os.getenv('READ_TIMEOUT', 30))),
+            refresh=args.refresh,
+            baseurl=os.getenv('API_URL', BASEURL),
+            rate_limit=float(os.getenv('RATE_LIMIT', 5)),
+            rate_burst=float(os.getenv('RATE_BURST', 10)),
+            retries=int(os.getenv('RETRIES', 3)),
+            # the daemon keeps the active machine around, its background thread refreshes it
+            active_ttl=DAEMON_REFRESH if args.daemon else float(os.getenv('ACTIVE_TTL', ACTIVE_TTL))
+            )
+    if args.accounts is not None:
+        try:
+            accounts = load_accounts(os.path.expanduser(os.getenv('ACCOUNTS_FILE', ACCOUNTS_FILE)), args.accounts)
+        except HTBError as e:
+            print(e)
+            sys.exit(1)
+        sys.exit(run_accounts(accounts, args, parser, settings))
+    client = HTBClient(os.getenv('API_TOKEN'), **settings)
+    if args.daemon:
+        run_daemon(client, parser, settings)
     else:
-        parser.print_help()
+        sys.exit(run_command(client, args, parser))
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# iter_json_items() gets fed files in 64 KiB blocks, so a value can be cut off anywhere
+# these split small documents at every chunk size and check it yields the same thing json.loads() does
+
+import os
+import sys
+import json
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from htb import iter_json_items
+
+# tricky values: numbers that look complete before the chunk ends (1 of 1.5, 2 of 2e3, -), escapes, braces in strings
+MACHINES = [
+        {'id': 1, 'name': 'Lame', 'stars': 4.5, 'difficulty': 2e3, 'rating': -12, 'retired': True, 'ip': None},
+        {'id': 10, 'name': 'Box "10" {}', 'stars': 0.25, 'difficulty': 1E-2, 'tags': ['a', [], {}], 'retired': False},
+        {'id': 123, 'name': 'Ünïcode \\u2603 \\n', 'stars': 5, 'feedback': {'counterEasy': 3, 'nested': {'x': [1.0, 2]}}}
+        ]
+
+# a /machine/list response, {'info': [...]}
+LIST_RESPONSE = json.dumps({'info': MACHINES, 'after': 1.5})
+# a get_machine_list() index, {'by_id': {...}} with other keys around it
+INDEX = json.dumps({'fetched': 1700000000.123, 'by_id': {str(machine['id']): machine for machine in MACHINES},
+                    'by_name': {machine['name'].lower(): str(machine['id']) for machine in MACHINES}}, indent=1)
+
+def chunked(text, size):
+    return (text[start:start + size] for start in range(0, len(text), size))
+
+class TestIterJsonItems(unittest.TestCase):
+    def test_list_every_chunk_size(self):
+        for size in range(1, len(LIST_RESPONSE) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_items(chunked(LIST_RESPONSE, size), 'info')), MACHINES)
+
+    def test_dict_every_chunk_size(self):
+        expected = list(json.loads(INDEX)['by_id'].items())
+        for size in range(1, len(INDEX) + 1):
+            with self.subTest(size=size):
+                self.assertEqual(list(iter_json_items(chunked(INDEX, size), 'by_id')), expected)
+
+    def test_stops_early(self):
+        # the rest of the chunks never get read once the caller has what it wants
+        chunks = chunked(LIST_RESPONSE, 16)
+        items = iter_json_items(chunks, 'info')
+        self.assertEqual(next(items), MACHINES[0])
+        self.assertTrue(any(True for _ in chunks))
+
+    def test_missing_key_or_empty(self):
+        self.assertEqual(list(iter_json_items([LIST_RESPONSE], 'by_id')), [])
+        self.assertEqual(list(iter_json_items(['{"info": [ ]}'], 'info')), [])
+        self.assertEqual(list(iter_json_items(['{"by_id": {}}'], 'by_id')), [])
+
+if __name__ == '__main__':
+    unittest.main()